@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+"""
+The exact distribution of the number of correct guesses in a line for
+each hat strategy of hats.py, with guesses flipped at error_rate.
+
+Hats are independent fair coins, so each strategy comes down to a sum
+of simple terms whose distribution is built up person by person:
+
+- guess_constant and guess_random are right half the time, each
+  person on their own.
+- guess_future: the first half are right half the time. Their
+  correspondents in the second half hear their own hat called, and
+  are right when neither or both of the pair's guesses are flipped.
+  Anyone left over at the end of an odd line is right half the time.
+- guess_parity: the first person is right half the time. After that
+  person i is right unless exactly one of guesses i-1 and i is
+  flipped, which is a Markov chain on whether the last guess was
+  flipped.
+
+With more than two colours of hat, right half the time becomes right
+one time in colours, and a mistake turns a guess into any of the other
+colours, so two mistakes only agree one time in colours - 1.
+
+Each takes time quadratic in the length of the line.
+"""
+
+import argparse
+
+import numpy as np
+
+import hats
+
+class Distribution:
+    """ Probabilities of 0 to persons correct guesses """
+
+    def __init__(self, probabilities):
+        self.probabilities = np.asarray(probabilities, dtype=float)
+
+    def mean(self):
+        return float(np.dot(np.arange(len(self.probabilities)), self.probabilities))
+
+    def variance(self):
+        counts = np.arange(len(self.probabilities))
+        return float(np.dot((counts - self.mean()) ** 2, self.probabilities))
+
+    def at_most(self, correct):
+        """ Probability of no more than correct right guesses """
+        return float(self.probabilities[:max(0, correct + 1)].sum())
+
+    def at_least(self, correct):
+        """ Probability of correct or more right guesses """
+        return float(self.probabilities[max(0, correct):].sum())
+
+def bernoulli_sum(chances):
+    """ Probabilities of 0, 1, ... successes of independent trials that
+    succeed with the given chances """
+    probabilities = np.zeros(len(chances) + 1)
+    probabilities[0] = 1.0
+    for (i, chance) in enumerate(chances):
+        # Shift up by one for a success
+        probabilities[1:i+2] = (probabilities[1:i+2] * (1 - chance) +
+                                probabilities[0:i+1] * chance)
+        probabilities[0] *= 1 - chance
+    return probabilities
+
+def coin_distribution(persons, error_rate, colours=2):
+    """ Everyone right one time in colours: guess_constant and
+    guess_random """
+    return Distribution(bernoulli_sum([ 1.0 / colours ] * persons))
+
+def future_distribution(persons, error_rate, colours=2):
+    half = int(persons / 2)
+    agree = error_rate ** 2 / (colours - 1) + (1 - error_rate) ** 2
+    chances = [ 1.0 / colours ] * half + [ agree ] * half + \
+              [ 1.0 / colours ] * (persons - 2 * half)
+    return Distribution(bernoulli_sum(chances))
+
+def parity_distribution(persons, error_rate, colours=2):
+    if persons == 0:
+        return Distribution([ 1.0 ])
+    # by_flip[f][k] is the probability that the last guess was flipped
+    # (f = 1) or not (f = 0) and k of those after the first were right
+    by_flip = np.zeros((2, persons))
+    by_flip[0][0] = 1 - error_rate
+    by_flip[1][0] = error_rate
+    # A flip after a flip to the same colour
+    repeat = error_rate / (colours - 1)
+    for i in range(1, persons):
+        same = np.zeros((2, persons))
+        same[:, 1:] = by_flip[:, :-1]
+        # Right if this guess is flipped just like the last one was
+        by_flip = np.array([ (1 - error_rate) * (same[0] + by_flip[1]),
+                             repeat * same[1] + (error_rate - repeat) * by_flip[1] +
+                             error_rate * by_flip[0] ])
+    rest = by_flip.sum(axis=0)
+    # The first person is right one time in colours, whatever happens
+    # after
+    probabilities = np.zeros(persons + 1)
+    probabilities[:-1] += (1 - 1.0 / colours) * rest
+    probabilities[1:] += 1.0 / colours * rest
+    return Distribution(probabilities)
+
+# The exact distribution for each strategy of hats.py
+strategies = {
+    hats.guess_constant: coin_distribution,
+    hats.guess_random: coin_distribution,
+    hats.guess_future: future_distribution,
+    hats.guess_parity: parity_distribution,
+    hats.ConstantStrategy: coin_distribution,
+    hats.RandomStrategy: coin_distribution,
+    hats.FutureStrategy: future_distribution,
+    hats.ParityStrategy: parity_distribution,
+}
+
+def distribution(strategy, persons=None, error_rate=None, colours=2):
+    """ The Distribution of correct guesses for a strategy, given as its
+    guess function or Strategy class. persons and error_rate default
+    to those of hats.py. """
+    if persons is None:
+        persons = hats.person_count
+    if error_rate is None:
+        error_rate = hats.error_rate
+    return strategies[strategy](persons, error_rate, colours)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Exact distribution of correct guesses for each hat strategy")
+    parser.add_argument("--persons", type=int, default=hats.person_count)
+    parser.add_argument("--error-rate", type=float, default=hats.error_rate)
+    parser.add_argument("--colours", type=int, default=2)
+    args = parser.parse_args()
+    for func in [hats.guess_constant, hats.guess_random, hats.guess_future,
+                 hats.guess_parity]:
+        d = distribution(func, args.persons, args.error_rate, args.colours)
+        print("%20s mean %.4f, sd %.4f, P(all correct) %.3g, P(<= 90%%) %.3g" %
+              (func.__name__, d.mean(), d.variance() ** 0.5, d.at_least(args.persons),
+               d.at_most(int(0.9 * args.persons))))
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+"""
+Run sweeps of hat experiments on all cores.
+
+A configuration is a strategy, a line length, an error rate and a
+number of hat colours. Its trials are split into shards of a fixed
+size, each simulated with montecarlo.py from its own seed, derived
+from the run's seed, the configuration and the shard's number. Shards
+only report integer totals, so a configuration's results come out the
+same, bit for bit, however many workers there are and whatever order
+the shards finish in. They do depend on the shard size.
+
+Each configuration's statistics, with a 95% confidence interval for
+the mean, are appended to a CSV or JSON lines file as soon as all its
+shards are in. Configurations already in the file for the same number
+of trials and seed are skipped, so an interrupted sweep picks up where
+it left off.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+
+import hats
+import montecarlo
+
+# Strategies by the name used in results
+strategy_names = dict((func.__name__, func) for func in montecarlo.strategies)
+
+fields = [ "strategy", "persons", "error_rate", "colours", "trials", "seed",
+           "mean", "sd", "ci_low", "ci_high", "min", "max" ]
+
+def normalise(config):
+    (strategy, persons, error_rate, colours) = config
+    return (strategy, int(persons), float(error_rate), int(colours))
+
+def config_key(config, trials, seed):
+    """ What identifies a configuration's results in a results file """
+    return normalise(config) + (int(trials), int(seed))
+
+def shard_seed(seed, config, shard):
+    """ The seed for one shard, depending only on these arguments """
+    tag = zlib.crc32(repr(normalise(config)).encode("ascii"))
+    return np.random.SeedSequence(entropy=[ seed, tag ], spawn_key=(shard,))
+
+def run_shard(config, trials, seed, shard):
+    """ Simulate one shard in a worker, returning the count, sum, sum
+    of squares, minimum and maximum of the correct guesses """
+    (strategy, persons, error_rate, colours) = config
+    rng = np.random.default_rng(shard_seed(seed, config, shard))
+    correct = montecarlo.simulate(strategy_names[strategy], trials, persons,
+                                  error_rate, rng, colours=colours).astype(np.int64)
+    return (len(correct), int(correct.sum()), int((correct * correct).sum()),
+            int(correct.min()), int(correct.max()))
+
+def summarise(config, trials, seed, totals):
+    """ The result record for a configuration from its shard totals """
+    (count, total, squares, low, high) = totals
+    mean = total / count
+    variance = max(0.0, (squares - total * total / count) / max(1, count - 1))
+    sd = variance ** 0.5
+    margin = 1.96 * sd / count ** 0.5
+    (strategy, persons, error_rate, colours) = config
+    return dict(strategy=strategy, persons=persons, error_rate=error_rate,
+                colours=colours, trials=trials, seed=seed, mean=mean, sd=sd,
+                ci_low=mean - margin, ci_high=mean + margin, min=low, max=high)
+
+def read_done(path):
+    """ Keys of the configurations already in a results file """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        if path.endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = [ json.loads(line) for line in f if line.strip() ]
+        for r in records:
+            done.add(config_key((r["strategy"], r["persons"], r["error_rate"],
+                                 r["colours"]), r["trials"], r["seed"]))
+    return done
+
+class ResultWriter:
+    """ Append result records to a CSV file, or JSON lines for any
+    other name, flushing each one """
+
+    def __init__(self, path):
+        self.csv = path.endswith(".csv")
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fields)
+            if new:
+                self.writer.writeheader()
+
+    def write(self, record):
+        if self.csv:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def run_sweep(configs, trials, seed=0, workers=None, shard_size=100000, done=()):
+    """ Generate a result record for each configuration, as they are
+    finished, skipping those whose key is in done. The trials of all
+    the configurations are run as shards on a pool of worker
+    processes. """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    shards = []
+    for config in configs:
+        if config_key(config, trials, seed) in done:
+            continue
+        for (shard, start) in enumerate(range(0, trials, shard_size)):
+            shards.append((config, min(shard_size, trials - start), shard))
+    shards_left = dict()
+    totals = dict()
+    for (config, count, shard) in shards:
+        shards_left[config] = shards_left.get(config, 0) + 1
+    in_flight = 2 * workers
+    pending = dict()
+    jobs = iter(shards)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        while True:
+            for (config, count, shard) in itertools.islice(jobs, in_flight - len(pending)):
+                pending[pool.submit(run_shard, config, count, seed, shard)] = config
+            if len(pending) == 0:
+                break
+            (finished, waiting) = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                config = pending.pop(future)
+                (count, total, squares, low, high) = future.result()
+                if config in totals:
+                    (c, t, s, l, h) = totals[config]
+                    totals[config] = (c + count, t + total, s + squares,
+                                      min(l, low), max(h, high))
+                else:
+                    totals[config] = (count, total, squares, low, high)
+                shards_left[config] -= 1
+                if shards_left[config] == 0:
+                    yield summarise(config, trials, seed, totals.pop(config))
+
+def parse_list(text, kind):
+    return [ kind(x) for x in text.split(",") ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Simulate hat strategies over a grid of configurations")
+    parser.add_argument("output", help="results file, CSV if it ends in .csv, "
+                                       "otherwise JSON lines")
+    parser.add_argument("--strategies", default=",".join(strategy_names),
+                        help="comma separated, from %s" % ", ".join(strategy_names))
+    parser.add_argument("--persons", default=str(hats.person_count),
+                        help="comma separated line lengths")
+    parser.add_argument("--error-rates", default=str(hats.error_rate),
+                        help="comma separated error rates")
+    parser.add_argument("--colours", default="2",
+                        help="comma separated numbers of hat colours")
+    parser.add_argument("--trials", type=int, default=1000000,
+                        help="trials per configuration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--shard-size", type=int, default=100000,
+                        help="trials per job sent to a worker")
+    args = parser.parse_args()
+    strategies = parse_list(args.strategies, str)
+    for s in strategies:
+        if s not in strategy_names:
+            parser.error("unknown strategy '%s'" % s)
+    configs = list(itertools.product(strategies, parse_list(args.persons, int),
+                                     parse_list(args.error_rates, float),
+                                     parse_list(args.colours, int)))
+    writer = ResultWriter(args.output)
+    try:
+        for record in run_sweep(configs, args.trials, args.seed, args.workers,
+                                args.shard_size, read_done(args.output)):
+            writer.write(record)
+            sys.stderr.write("%s persons=%d error_rate=%g colours=%d: mean %.4f\n" %
+                             (record["strategy"], record["persons"], record["error_rate"],
+                              record["colours"], record["mean"]))
+    finally:
+        writer.close()
@@ -8,6 +8,12 @@ half_person_count = int(person_count / 2)
 # Hat choices
 hat_choices = ['r','b']
 hat_opposite = {'b':'r', 'r':'b'}
+# Strategy objects and run_test work with hats as small integer codes,
+# the index of the colour here: 0 for red, 1 for blue and so on for
+# lines with more colours
+colour_letters = "rbgyopcw"
+colour_table = bytes.maketrans(bytes(range(0, len(colour_letters))),
+                               colour_letters.encode("ascii"))
 
 # 0.1% error rate in guesses
 error_rate = 0.001
@@ -20,11 +26,10 @@ def guess_random(heard_guesses, seen_hats):
 
 def guess_future(heard_guesses, seen_hats):
     """ First half of list calls out hat of correspondent in second half of list """
-    full_list = heard_guesses + ['x'] + seen_hats
     my_index = len(heard_guesses)
     if my_index < half_person_count:
         # Call out the hat of the person in the second half of the list, hope same as mine
-        return full_list[my_index+half_person_count]
+        return seen_hats[half_person_count-1]
     else:
         # Remember what was called out by my corresponding person in first half of list
         return heard_guesses[my_index - half_person_count]
@@ -38,43 +43,172 @@ def guess_parity(heard_guesses, seen_hats):
     else:
         return 'r'
 
-def run_test(guess_func):
-    hat_list = [ random.choice(hat_choices) for i in range(0, person_count) ]
-    print("Actual: " + "".join(hat_list))
-    answer_list = []
-    score_list = []
-    error_list = []
+def colour_names(codes):
+    """ The letters of a line of colour codes, as a string """
+    return bytes(codes).translate(colour_table).decode("ascii")
+
+class Letters:
+    """ The letters of colour codes start to stop of a line, read as
+    they're needed, so a guess function can be handed part of the line
+    without copying it """
+
+    def __init__(self, codes, start, stop):
+        self.codes = codes
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Letters index out of range")
+        return colour_letters[self.codes[self.start + i]]
+
+    def __iter__(self):
+        for c in self.codes[self.start:self.stop]:
+            yield colour_letters[c]
+
+class Strategy:
+    """ A strategy that follows the line as it goes, instead of being
+    handed every guess and hat again for each person. start() is
+    called with the hats the first person sees, as colour codes in a
+    memoryview of the line, and where to put the codes called, a
+    memoryview as long as the whole line; then guess() and hear() in
+    turn for each person: guess() is the code the person whose turn it
+    is would call, and hear() is what they actually called, which
+    everyone hears before the next person's turn. """
+
+    def start(self, seen_hats, colours=2, heard_guesses=None):
+        if heard_guesses is None:
+            heard_guesses = memoryview(bytearray(len(seen_hats) + 1))
+        self.seen_hats = seen_hats
+        self.heard_guesses = heard_guesses
+        self.colours = colours
+        self.position = 0
+
+    def guess(self):
+        raise NotImplementedError
+
+    def hear(self, guess):
+        self.heard_guesses[self.position] = guess
+        self.position += 1
+
+class ConstantStrategy(Strategy):
+    def guess(self):
+        return 1
+
+class RandomStrategy(Strategy):
+    def guess(self):
+        return random.randrange(self.colours)
+
+class FutureStrategy(Strategy):
+    """ First half of list calls out hat of correspondent in second half of list """
+
+    def start(self, seen_hats, colours=2, heard_guesses=None):
+        Strategy.start(self, seen_hats, colours, heard_guesses)
+        self.half = int((len(seen_hats) + 1) / 2)
+
+    def guess(self):
+        if self.half == 0:
+            # Alone in the line, with no one to call for
+            return 1
+        if self.position < self.half:
+            # Person position + half is seen_hats[position + half - 1]
+            return self.seen_hats[self.position + self.half - 1]
+        else:
+            return self.heard_guesses[self.position - self.half]
+
+class ParityStrategy(Strategy):
+    """ Keep sums of the colours heard and still seen, and call out
+    whatever makes blue plus the seen minus the heard, modulo the
+    number of colours: for red and blue, blue for an even count of
+    blues and red for odd. """
+
+    def start(self, seen_hats, colours=2, heard_guesses=None):
+        Strategy.start(self, seen_hats, colours, heard_guesses)
+        self.heard_total = 0
+        self.seen_total = sum(seen_hats)
+
+    def guess(self):
+        return (1 - self.heard_total - self.seen_total) % self.colours
+
+    def hear(self, guess):
+        self.heard_total += guess
+        # The next person can't see their own hat
+        if self.position < len(self.seen_hats):
+            self.seen_total -= self.seen_hats[self.position]
+        Strategy.hear(self, guess)
+
+class FunctionStrategy(Strategy):
+    """ Play a guess function, such as guess_parity, which is given
+    all the guesses heard and hats seen as sequences of letters on
+    every call, Letters over the line rather than copies of it """
+
+    def __init__(self, guess_func):
+        self.guess_func = guess_func
+
+    def guess(self):
+        letter = self.guess_func(Letters(self.heard_guesses, 0, self.position),
+                                 Letters(self.seen_hats, self.position, len(self.seen_hats)))
+        return colour_letters.index(letter)
+
+def as_strategy(strategy):
+    """ A Strategy from a Strategy, a Strategy class or a guess function """
+    if isinstance(strategy, Strategy):
+        return strategy
+    if isinstance(strategy, type) and issubclass(strategy, Strategy):
+        return strategy()
+    return FunctionStrategy(strategy)
+
+def run_test(strategy, count=None, verbose=True, colours=2):
+    """ Play one line of count people, person_count by default, with a
+    Strategy or a guess function, and return how many were right.
+    Hats come in colours colours; a mistake turns a guess into one of
+    the others. """
+    if count is None:
+        count = person_count
+    if not 2 <= colours <= len(colour_letters):
+        raise ValueError("Can only play with 2 to %d colours" % len(colour_letters))
+    strategy = as_strategy(strategy)
+    hat_line = bytearray([ random.randrange(colours) for i in range(0, count) ])
+    called_line = bytearray(count)
     correct = 0
-    for i in range(0, person_count):
-        guess = guess_func(answer_list, hat_list[i+1:])
+    strategy.start(memoryview(hat_line)[1:], colours, memoryview(called_line))
+    for i in range(0, count):
+        guess = strategy.guess()
         if random.random() < error_rate:
-            guess = hat_opposite[guess]
-            error_list.append('X')
-        else:
-            error_list.append('-')
-        answer_list.append(guess)
-        if guess == hat_list[i]:
+            if colours == 2:
+                guess ^= 1
+            else:
+                guess = (guess + random.randrange(1, colours)) % colours
+        # Puts the guess in called_line
+        strategy.hear(guess)
+        if guess == hat_line[i]:
             correct += 1
-            score_list.append('-')
-        else:
-            score_list.append('X')
-    print("""
+    if verbose:
+        score = bytes([ ord('-') if called_line[i] == hat_line[i] else ord('X')
+                        for i in range(0, count) ])
+        print("Actual: " + colour_names(hat_line))
+        print("""
 Called: %s
 Score:  %s
   %d correct
-""" % ("".join(answer_list), "".join(score_list), correct))
+""" % (colour_names(called_line), score.decode("ascii"), correct))
     return correct
 
 if __name__ == "__main__":
     trial_count = 10
     averages = dict()
-    for func in [guess_constant, guess_random, guess_future, guess_parity]:
+    for strategy in [ConstantStrategy, RandomStrategy, FutureStrategy, ParityStrategy]:
         correct_total = 0.0
-        print("%s:" % func.__name__)
+        print("%s:" % strategy.__name__)
         for i in range(0, trial_count):
             print("Trial %d" % (i+1))
-            correct_total += run_test(func)
-        averages[func.__name__] = (correct_total / trial_count)
+            correct_total += run_test(strategy)
+        averages[strategy.__name__] = (correct_total / trial_count)
     for (f,v) in averages.items():
         print("%20s average correct: %.2f" % (f,v))
 
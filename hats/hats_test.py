@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+
+import contextlib
+import io
+import itertools
+import os
+import random
+import tempfile
+import unittest
+import numpy as np
+
+import analytic
+import experiment
+import hats
+import montecarlo
+
+def play(strategy, hat_line, errors, colours=2):
+    """ The codes called by a line playing a strategy one person at a
+    time, with each guess changed by the amount in errors """
+    strategy = hats.as_strategy(strategy)
+    strategy.start(memoryview(bytearray(hat_line))[1:], colours)
+    called = []
+    for e in errors:
+        guess = (strategy.guess() + int(e)) % colours
+        strategy.hear(guess)
+        called.append(guess)
+    return called
+
+def list_run_test(guess_func):
+    """ run_test as it was with lists of letters, to check the output of
+    the current one against """
+    hat_list = [ random.choice(hats.hat_choices) for i in range(0, hats.person_count) ]
+    print("Actual: " + "".join(hat_list))
+    answer_list = []
+    score_list = []
+    correct = 0
+    for i in range(0, hats.person_count):
+        guess = guess_func(answer_list, hat_list[i+1:])
+        if random.random() < hats.error_rate:
+            guess = hats.hat_opposite[guess]
+        answer_list.append(guess)
+        if guess == hat_list[i]:
+            correct += 1
+            score_list.append('-')
+        else:
+            score_list.append('X')
+    print("""
+Called: %s
+Score:  %s
+  %d correct
+""" % ("".join(answer_list), "".join(score_list), correct))
+    return correct
+
+def brute_force(strategy, persons, error_rate, colours):
+    """ Probabilities of each number of correct guesses, from playing
+    every line of hats with every set of mistakes """
+    probabilities = np.zeros(persons + 1)
+    change = [ 1 - error_rate ] + [ error_rate / (colours - 1) ] * (colours - 1)
+    for hat_line in itertools.product(range(0, colours), repeat=persons):
+        for errors in itertools.product(range(0, colours), repeat=persons):
+            chance = np.prod([ change[e] for e in errors ]) / colours ** persons
+            called = play(strategy, hat_line, errors, colours)
+            probabilities[sum([ c == h for (c, h) in zip(called, hat_line) ])] += chance
+    return probabilities
+
+class TestHats(unittest.TestCase):
+    def test_montecarlo(self):
+        rng = np.random.default_rng(3)
+        # The guess functions only know lines of person_count
+        for (colours, persons, funcs) in [
+                (2, hats.person_count, [ hats.guess_constant, hats.guess_future,
+                                         hats.guess_parity ]),
+                (3, 11, [ hats.ConstantStrategy, hats.FutureStrategy,
+                          hats.ParityStrategy ]),
+                (2, 1, [ hats.ConstantStrategy, hats.FutureStrategy,
+                         hats.ParityStrategy ])]:
+            hat_array = montecarlo.random_hats(20, persons, rng, colours)
+            errors = montecarlo.random_errors(20, persons, 0.2, rng, colours)
+            self.assertTrue((errors > 0).any())
+            self.assertTrue((hat_array < colours).all() and (errors < colours).all())
+            for (func, called_func) in zip(funcs, [ montecarlo.called_constant,
+                                                    montecarlo.called_future,
+                                                    montecarlo.called_parity ]):
+                called = called_func(hat_array, errors, rng, colours)
+                for t in range(0, len(hat_array)):
+                    self.assertEqual(list(called[t]),
+                                     play(func, hat_array[t], errors[t], colours))
+            called = montecarlo.called_random(hat_array, errors, rng, colours)
+            self.assertTrue((called < colours).all())
+
+    def test_simulate(self):
+        rng = np.random.default_rng(5)
+        trials = 100000
+        for func in montecarlo.strategies:
+            for colours in [2, 3]:
+                correct = montecarlo.simulate(func, trials, 40, 0.05, rng, 10000, colours)
+                d = analytic.distribution(func, 40, 0.05, colours)
+                self.assertLess(abs(correct.mean() - d.mean()),
+                                5 * (d.variance() / trials) ** 0.5)
+
+    def test_analytic(self):
+        for (colours, most) in [ (2, 6), (3, 4) ]:
+            for persons in range(0, most + 1):
+                for strategy in [ hats.ConstantStrategy, hats.FutureStrategy,
+                                  hats.ParityStrategy ]:
+                    d = analytic.distribution(strategy, persons, 0.1, colours)
+                    self.assertTrue(np.allclose(d.probabilities,
+                                                brute_force(strategy, persons, 0.1, colours)))
+        d = analytic.distribution(hats.guess_parity, 10, 0.0)
+        self.assertAlmostEqual(d.mean(), 9.5)
+        self.assertAlmostEqual(d.variance(), 0.25)
+        self.assertAlmostEqual(d.at_least(10), 0.5)
+        self.assertAlmostEqual(d.at_most(8), 0.0)
+        self.assertEqual(analytic.distribution(hats.guess_random, 0, 0.1).mean(), 0.0)
+
+    def test_strategies(self):
+        # Each Strategy plays just like its function, random numbers and all
+        for (func, strategy) in [ (hats.guess_constant, hats.ConstantStrategy),
+                                  (hats.guess_random, hats.RandomStrategy),
+                                  (hats.guess_future, hats.FutureStrategy),
+                                  (hats.guess_parity, hats.ParityStrategy) ]:
+            for seed in range(0, 5):
+                outputs = []
+                for s in [ func, strategy, strategy() ]:
+                    random.seed(seed)
+                    with contextlib.redirect_stdout(io.StringIO()) as out:
+                        correct = hats.run_test(s)
+                    outputs.append((correct, out.getvalue()))
+                self.assertEqual(outputs[0], outputs[1])
+                self.assertEqual(outputs[0], outputs[2])
+        # Without mistakes only the first person can be wrong
+        rate = hats.error_rate
+        hats.error_rate = 0
+        try:
+            self.assertGreaterEqual(hats.run_test(hats.ParityStrategy, count=1000,
+                                                  verbose=False, colours=5), 999)
+        finally:
+            hats.error_rate = rate
+        self.assertRaises(ValueError, hats.run_test, hats.ParityStrategy, colours=1)
+        for strategy in [ hats.ConstantStrategy, hats.FutureStrategy, hats.ParityStrategy ]:
+            self.assertEqual(len(play(strategy, [ 0 ], [ 0 ])), 1)
+            self.assertEqual(play(strategy, [], []), [])
+
+    def test_run_test_output(self):
+        # Plenty of mistakes, to see they come out the same
+        rate = hats.error_rate
+        hats.error_rate = 0.05
+        try:
+            for func in [ hats.guess_constant, hats.guess_random, hats.guess_future,
+                          hats.guess_parity ]:
+                for seed in range(0, 5):
+                    outputs = []
+                    for run in [ list_run_test, hats.run_test ]:
+                        random.seed(seed)
+                        with contextlib.redirect_stdout(io.StringIO()) as out:
+                            correct = run(func)
+                        outputs.append((correct, out.getvalue()))
+                    self.assertEqual(outputs[0], outputs[1])
+        finally:
+            hats.error_rate = rate
+
+    def test_experiment(self):
+        configs = list(itertools.product([ "guess_future", "guess_parity" ], [ 10, 21 ],
+                                         [ 0.05 ], [ 2, 3 ]))
+
+        def sweep(workers, done=()):
+            records = experiment.run_sweep(configs, 5000, seed=9, workers=workers,
+                                           shard_size=700, done=done)
+            return sorted(records, key=lambda r: experiment.config_key(
+                (r["strategy"], r["persons"], r["error_rate"], r["colours"]),
+                r["trials"], r["seed"]))
+
+        # The same results, bit for bit, with any number of workers
+        one = sweep(1)
+        self.assertEqual(len(one), len(configs))
+        self.assertEqual(one, sweep(3))
+        for r in one:
+            self.assertLessEqual(r["ci_low"], r["mean"])
+            self.assertLessEqual(r["mean"], r["ci_high"])
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in [ "results.csv", "results.jsonl" ]:
+                path = os.path.join(tmp, name)
+                writer = experiment.ResultWriter(path)
+                for r in one[:3]:
+                    writer.write(r)
+                writer.close()
+                done = experiment.read_done(path)
+                self.assertEqual(len(done), 3)
+                # Finish off the rest, skipping what's in the file
+                rest = sweep(2, done)
+                self.assertEqual(rest, one[3:])
+                writer = experiment.ResultWriter(path)
+                for r in rest:
+                    writer.write(r)
+                writer.close()
+                self.assertEqual(len(experiment.read_done(path)), len(configs))
+                self.assertEqual(sweep(2, experiment.read_done(path)), [])
+                # Another seed isn't done yet
+                self.assertEqual(len(list(experiment.run_sweep(
+                    configs[:1], 5000, seed=10, workers=1, done=experiment.read_done(path)))), 1)
+
+if __name__ == "__main__":
+    unittest.main()
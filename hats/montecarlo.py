@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+"""
+Simulate the hat strategies of hats.py for many lines at once.
+
+A batch of trials is a (trials x persons) array of hats, 1 for blue
+and 0 for red, along with an array of the same shape saying whose
+guess gets flipped by mistake. Each strategy works out every guess of
+every trial with array operations, so there is no Python call per
+person; run_test in hats.py plays the same game one line at a time.
+
+The strategies also work with more than two colours of hat, numbered
+from 0. A mistake then turns a guess into one of the other colours at
+random, and the parity strategy counts colours modulo their number.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import hats
+
+def add_colours(a, b, colours):
+    """ a + b modulo colours, for arrays of colours """
+    if colours == 2:
+        return a ^ b
+    total = a + b
+    np.subtract(total, colours, out=total, where=total >= colours)
+    return total
+
+def subtract_colours(a, b, colours):
+    """ a - b modulo colours, for arrays of colours """
+    if colours == 2:
+        return a ^ b
+    return add_colours(a, colours - b, colours)
+
+def random_hats(trials, persons, rng, colours=2):
+    """ A (trials x persons) array of random hats """
+    if colours != 2:
+        return rng.integers(0, colours, size=(trials, persons), dtype=np.uint8)
+    bits = rng.integers(0, 256, size=(trials, (persons + 7) // 8), dtype=np.uint8)
+    return np.unpackbits(bits, axis=1)[:, :persons]
+
+def random_errors(trials, persons, error_rate, rng, colours=2):
+    """ A (trials x persons) array of how much each guess is changed
+    by mistake, modulo colours: nothing, or with probability
+    error_rate any other colour. The gaps between mistakes are drawn
+    rather than a number per person, as mistakes are rare. """
+    errors = np.zeros(trials * persons, dtype=np.uint8)
+    if error_rate > 0:
+        expected = trials * persons * error_rate
+        gaps = rng.geometric(error_rate, size=int(expected + 10 * expected ** 0.5) + 10)
+        places = np.cumsum(gaps) - 1
+        while places[-1] < len(errors):
+            more = np.cumsum(rng.geometric(error_rate, size=len(gaps))) + places[-1]
+            places = np.concatenate([ places, more ])
+        places = places[places < len(errors)]
+        if colours == 2:
+            errors[places] = 1
+        else:
+            errors[places] = rng.integers(1, colours, size=len(places), dtype=np.uint8)
+    return errors.reshape((trials, persons))
+
+def called_constant(hat_array, errors, rng, colours=2):
+    """ Everyone calls blue """
+    return add_colours(np.ones_like(errors), errors, colours)
+
+def called_random(hat_array, errors, rng, colours=2):
+    """ Everyone calls at random """
+    return add_colours(random_hats(*hat_array.shape, rng, colours), errors, colours)
+
+def called_future(hat_array, errors, rng, colours=2):
+    """ The first half call the hat of their correspondent in the
+    second half, who repeat what they heard """
+    persons = hat_array.shape[1]
+    half = int(persons / 2)
+    if half == 0:
+        # Alone in the line, with no one to call for
+        return called_constant(hat_array, errors, rng, colours)
+    called = np.empty_like(hat_array)
+    called[:, :half] = add_colours(hat_array[:, half:2*half], errors[:, :half], colours)
+    for start in range(half, persons, half):
+        stop = min(start + half, persons)
+        called[:, start:stop] = add_colours(called[:, start-half:stop-half],
+                                            errors[:, start:stop], colours)
+    return called
+
+def called_parity(hat_array, errors, rng, colours=2):
+    """ Everyone calls blue plus the colours they saw and minus those
+    they heard, modulo colours, which for two colours is blue if the
+    blues are even. Working through the sums, the first person is
+    right when the hats add up to blue, unless their guess is
+    changed, and after that person i is wrong exactly when guesses
+    i-1 and i are changed by different amounts: a mistake misleads
+    the next person, and everyone after that cancels it out. """
+    total = hat_array.sum(axis=1, dtype=np.int64) % colours
+    wrong = np.empty_like(hat_array)
+    wrong[:, 0] = add_colours(((1 - total) % colours).astype(np.uint8),
+                              errors[:, 0], colours)
+    wrong[:, 1:] = subtract_colours(errors[:, 1:], errors[:, :-1], colours)
+    return add_colours(hat_array, wrong, colours)
+
+# What each strategy of hats.py calls out, for a batch of trials
+strategies = {
+    hats.guess_constant: called_constant,
+    hats.guess_random: called_random,
+    hats.guess_future: called_future,
+    hats.guess_parity: called_parity,
+}
+
+def simulate(guess_func, trials, persons=None, error_rate=None, rng=None,
+             chunk_size=100000, colours=2):
+    """ Play trials lines of a strategy, given as its hats.py guess
+    function, and return how many were correct in each as an array.
+    persons and error_rate default to those of hats.py. """
+    if persons is None:
+        persons = hats.person_count
+    if error_rate is None:
+        error_rate = hats.error_rate
+    if rng is None:
+        rng = np.random.default_rng()
+    called_func = strategies[guess_func]
+    correct = np.empty(trials, dtype=np.int32)
+    for start in range(0, trials, chunk_size):
+        count = min(chunk_size, trials - start)
+        hat_array = random_hats(count, persons, rng, colours)
+        errors = random_errors(count, persons, error_rate, rng, colours)
+        called = called_func(hat_array, errors, rng, colours)
+        correct[start:start+count] = (called == hat_array).sum(axis=1)
+    return correct
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Average correct guesses of each hat strategy over many trials")
+    parser.add_argument("--trials", type=int, default=1000000)
+    parser.add_argument("--colours", type=int, default=2)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    for func in strategies:
+        start = time.time()
+        correct = simulate(func, args.trials, rng=rng, colours=args.colours)
+        print("%20s average correct: %.4f (sd %.2f, min %d) in %.1fs" %
+              (func.__name__, correct.mean(), correct.std(), correct.min(),
+               time.time() - start))
@@ -0,0 +1,166 @@
+"""
+Validate and pre-solve many sudoku grids at once with NumPy.
+
+A batch is an integer array of shape (N, 9, 9), or (N, 16, 16) and so
+on, holding the numbers with 0 for an empty cell. As in Sudoku, sets of
+numbers are bitmasks with bit n-1 standing for number n, here held in
+integer arrays so that every grid of the batch is worked on at once.
+Only the grids that are still unresolved are handed to Sudoku one at a
+time.
+"""
+
+import numpy as np
+
+import sudoku
+
+# What propagate() found out about each grid
+STUCK = 0     # needs a search
+SOLVED = 1
+INVALID = 2   # duplicates, or a cell or number with nowhere to go
+
+def lines_to_array(lines):
+    """ One grid from Sudoku lines to an array """
+    values = dict((sudoku.cell_alphabet[n], n + 1) for n in range(0, len(lines)))
+    return np.array([ [ values.get(ch, 0) for ch in l ] for l in lines ],
+                    dtype=np.int8)
+
+def array_to_lines(grid):
+    """ One grid from an array to Sudoku lines """
+    alphabet = "." + sudoku.cell_alphabet
+    return [ [ alphabet[n] for n in row ] for row in grid.tolist() ]
+
+def square_size(grids):
+    """ The square size of a batch, checking its shape """
+    if grids.ndim != 3 or grids.shape[1] != grids.shape[2]:
+        raise ValueError("Expected an (N, n, n) array, got shape %s" %
+                         str(grids.shape))
+    root = int(round(grids.shape[1] ** 0.5))
+    if root * root != grids.shape[1] or root < 2:
+        raise ValueError("Grids of %d rows don't have square sizes" % grids.shape[1])
+    return root
+
+def square_view(cells, root):
+    """ View an (N, n, n) array as (N, root, root, root, root), that is
+    band, row in band, stack, column in stack """
+    return cells.reshape((cells.shape[0], root, root, root, root))
+
+def popcount(masks, cardinal):
+    """ Number of bits set in each mask """
+    counts = np.zeros(masks.shape, dtype=np.int8)
+    for b in range(0, cardinal):
+        counts += (masks >> b) & 1
+    return counts
+
+def cell_bits(grids):
+    """ Each cell's number as a one bit mask, or 0 if empty """
+    grids = grids.astype(np.int32)
+    return np.where(grids > 0, np.left_shift(1, np.maximum(grids - 1, 0)), 0)
+
+def group_masks(bits, root):
+    """ Masks of the numbers in each row, column and square. Squares
+    are (N, root, root), by band and stack. """
+    rows = np.bitwise_or.reduce(bits, axis=2)
+    cols = np.bitwise_or.reduce(bits, axis=1)
+    squares = np.bitwise_or.reduce(square_view(bits, root), axis=(2, 4))
+    return (rows, cols, squares)
+
+def validate(grids):
+    """ Boolean array saying which grids have no number out of range
+    and no duplicate number in any row, column or square """
+    grids = np.asarray(grids)
+    root = square_size(grids)
+    cardinal = grids.shape[1]
+    valid = ((grids >= 0) & (grids <= cardinal)).all(axis=(1, 2))
+    grids = np.where(valid[:, None, None], grids, 0)
+    filled = (grids > 0).astype(np.int8)
+    (rows, cols, squares) = group_masks(cell_bits(grids), root)
+    # A group has a duplicate if it has fewer numbers than filled cells
+    valid &= (popcount(rows, cardinal) == filled.sum(axis=2)).all(axis=1)
+    valid &= (popcount(cols, cardinal) == filled.sum(axis=1)).all(axis=1)
+    valid &= (popcount(squares, cardinal) ==
+              square_view(filled, root).sum(axis=(2, 4))).all(axis=(1, 2))
+    return valid
+
+def hidden_singles(possible, missing):
+    """ Numbers with exactly one place left in a group. possible is
+    (..., cells in group) candidate masks and missing the (...) masks
+    of numbers the groups still need. Returns the hidden singles and
+    the numbers with nowhere to go. """
+    once = np.zeros(missing.shape, dtype=possible.dtype)
+    twice = np.zeros(missing.shape, dtype=possible.dtype)
+    for i in range(0, possible.shape[-1]):
+        twice |= once & possible[..., i]
+        once |= possible[..., i]
+    return (missing & once & ~twice, missing & ~once)
+
+def propagate_round(grids, root):
+    """ Fill in every naked and hidden single of every grid at once.
+    Returns how many cells were filled in each grid, or -1 where a
+    grid turned out to have no solution. """
+    (count, cardinal) = (grids.shape[0], grids.shape[1])
+    full = (1 << cardinal) - 1
+    empty = grids == 0
+    (rows, cols, squares) = group_masks(cell_bits(grids), root)
+    taken = rows[:, :, None] | cols[:, None, :]
+    square_view(taken, root)[...] |= squares[:, :, None, :, None]
+    possible = np.where(empty, full & ~taken, 0)
+    dead = (empty & (possible == 0)).any(axis=(1, 2))
+    # Naked singles: cells with one candidate
+    naked = np.where(possible & (possible - 1) == 0, possible, 0)
+    # Hidden singles: numbers with one place left in a row, column
+    # or square
+    (row_hidden, row_lost) = hidden_singles(possible, full & ~rows)
+    (col_hidden, col_lost) = hidden_singles(possible.transpose(0, 2, 1), full & ~cols)
+    by_square = square_view(possible, root).transpose(0, 1, 3, 2, 4)
+    by_square = by_square.reshape((count, root, root, cardinal))
+    (square_hidden, square_lost) = hidden_singles(by_square, full & ~squares)
+    dead |= (row_lost != 0).any(axis=1) | (col_lost != 0).any(axis=1)
+    dead |= (square_lost != 0).any(axis=(1, 2))
+    hidden = row_hidden[:, :, None] | col_hidden[:, None, :]
+    square_view(hidden, root)[...] |= square_hidden[:, :, None, :, None]
+    hidden &= possible
+    moves = np.where(hidden, hidden, naked)
+    # A cell that is a single for two numbers is a dead end
+    dead |= ((moves & (moves - 1)) != 0).any(axis=(1, 2))
+    moves = np.where(moves & (moves - 1) == 0, moves, 0)
+    filled = (moves != 0).sum(axis=(1, 2))
+    grids += np.where(moves != 0, popcount(moves - 1, cardinal) + 1, 0).astype(grids.dtype)
+    # Singles placed side by side may clash with each other
+    dead |= ~validate(grids)
+    filled[dead] = -1
+    return filled
+
+def propagate(grids, max_rounds=None):
+    """ Run rounds of single propagation over a batch until nothing
+    changes. Returns the propagated copy of the grids and, for each
+    grid, STUCK, SOLVED or INVALID. """
+    grids = np.array(grids, dtype=np.int8)
+    root = square_size(grids)
+    status = np.where(validate(grids), STUCK, INVALID).astype(np.int8)
+    active = np.flatnonzero(status == STUCK)
+    rounds = 0
+    while len(active) > 0 and (max_rounds is None or rounds < max_rounds):
+        rounds += 1
+        work = grids[active]
+        filled = propagate_round(work, root)
+        grids[active] = work
+        status[active[filled < 0]] = INVALID
+        active = active[filled > 0]
+    status[(status == STUCK) & (grids != 0).all(axis=(1, 2))] = SOLVED
+    return (grids, status)
+
+def solve(grids, backend="propagate"):
+    """ Solve a batch: propagate over all of it, then search the grids
+    still stuck one at a time with Sudoku.solution(backend). Returns
+    the grids, solved as far as possible, and whether each one was
+    solved. """
+    (grids, status) = propagate(grids)
+    for i in np.flatnonzero(status == STUCK):
+        try:
+            lines = sudoku.Sudoku(array_to_lines(grids[i])).solution(backend=backend)
+        except (sudoku.InvalidGridError, sudoku.UnsolvableGridError):
+            status[i] = INVALID
+            continue
+        grids[i] = lines_to_array(lines)
+        status[i] = SOLVED
+    return (grids, status == SOLVED)
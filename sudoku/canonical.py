@@ -0,0 +1,174 @@
+"""
+Canonical forms of 9x9 sudoku grids, and a solution cache keyed by them.
+
+Grids that are the same up to the symmetries in symmetry.py share a
+canonical form: of all the grids a grid can be transformed into, the
+one whose compact string is smallest, with blanks written as 0 and the
+numbers relabelled in order of first appearance.
+
+Finding it tries every transposition and order of the columns at once
+with NumPy, and then picks rows one at a time, keeping only the
+choices that give the smallest string so far.
+"""
+
+import collections
+import dbm
+import itertools
+
+import numpy as np
+
+import sudoku
+import symmetry
+
+def column_orders(cardinal_root=3):
+    """ Every order of columns that keeps stacks together """
+    orders = []
+    blocks = list(range(0, cardinal_root))
+    within = list(itertools.permutations(blocks))
+    for stacks in itertools.permutations(blocks):
+        for inner in itertools.product(within, repeat=cardinal_root):
+            orders.append([ s * cardinal_root + i
+                            for (s, order) in zip(stacks, inner) for i in order ])
+    return np.array(orders, dtype=np.int8)
+
+all_column_orders = column_orders()
+# Grids with a lot of symmetry, such as nearly empty ones, tie in too
+# many ways to follow them all. Only this many states are kept, so
+# symmetric copies of such grids may not all get the same form: a
+# cache miss, never a wrong answer.
+max_states = 20000
+# Place values for turning a row of the canonical string into an integer
+row_weights = 10 ** np.arange(8, -1, -1, dtype=np.int64)
+
+def canonical_form(lines):
+    """ Return the canonical compact string of a 9x9 grid and the
+    transform, as in symmetry.py, that turns the grid into it. Raises
+    InvalidGridError for a grid that breaks the rules, as Sudoku does. """
+    if len(lines) != 9:
+        raise ValueError("Canonical forms are only for 9x9 grids")
+    sudoku.Sudoku(lines)
+    values = dict((sudoku.cell_alphabet[n], n + 1) for n in range(0, 9))
+    grid = np.array([ [ values.get(ch, 0) for ch in l ] for l in lines ],
+                    dtype=np.int8)
+    grids = np.array([ grid, grid.T ])
+    # One state per transposition and column order still in the running
+    orientations = len(all_column_orders)
+    transposed = np.repeat(np.arange(0, 2), orientations)
+    columns = np.tile(all_column_orders, (2, 1))
+    # Rows chosen so far, labels given to numbers (0 for none yet)
+    # and the next label to give
+    rows = np.zeros((len(transposed), 0), dtype=np.int8)
+    labels = np.zeros((len(transposed), 10), dtype=np.int8)
+    next_label = np.ones(len(transposed), dtype=np.int8)
+    key = []
+    for level in range(0, 9):
+        count = len(transposed)
+        states = np.arange(0, count)
+        # Which rows may come next: any row of an unused band at the
+        # start of a band, otherwise an unused row in the same band
+        allowed = np.ones((count, 9), dtype=bool)
+        if level % 3 == 0:
+            for band in range(0, level // 3):
+                used = rows[:, band * 3] // 3
+                allowed &= (np.arange(0, 9)[None, :] // 3) != used[:, None]
+        else:
+            band = rows[:, level - 1] // 3
+            allowed &= (np.arange(0, 9)[None, :] // 3) == band[:, None]
+            for i in range(level - level % 3, level):
+                allowed[states, rows[:, i]] = False
+        # cells[s, r, j] is column j of candidate row r for state s
+        cells = grids[transposed[:, None, None], np.arange(0, 9)[None, :, None],
+                      columns[:, None, :]]
+        known = labels[states[:, None, None], cells]
+        new = (cells > 0) & (known == 0)
+        # Numbers in a row are all different, so new ones just get
+        # the next labels in turn
+        fresh = next_label[:, None, None] + np.cumsum(new, axis=2, dtype=np.int8) - 1
+        relabelled = np.where(new, fresh, known)
+        scores = np.dot(relabelled, row_weights)
+        scores[~allowed] = np.iinfo(np.int64).max
+        best = scores.min()
+        (keep, chosen) = np.nonzero(scores == best)
+        (keep, chosen) = (keep[:max_states], chosen[:max_states])
+        key.append(relabelled[keep[0], chosen[0]])
+        # Carry the winning states forward, with their new labels
+        (new, cells, relabelled) = (new[keep, chosen], cells[keep, chosen],
+                                    relabelled[keep, chosen])
+        transposed = transposed[keep]
+        columns = columns[keep]
+        rows = np.concatenate([ rows[keep], chosen[:, None].astype(np.int8) ], axis=1)
+        labels = labels[keep]
+        (state, j) = np.nonzero(new)
+        labels[state, cells[state, j]] = relabelled[state, j]
+        next_label = next_label[keep] + new.sum(axis=1)
+    canonical = "".join([ "%d" % n for n in np.concatenate(key) ])
+    # Numbers missing from the grid get the labels left over
+    numbers = [ int(n) for n in labels[0][1:] ]
+    spare = iter(range(int(next_label[0]), 10))
+    numbers = [ n if n > 0 else next(spare) for n in numbers ]
+    transform = (bool(transposed[0]), [ int(r) for r in rows[0] ],
+                 [ int(c) for c in columns[0] ], numbers)
+    return (canonical.replace("0", "."), transform)
+
+class SolutionCache:
+    """ Solutions of 9x9 grids keyed by canonical form, so a grid that
+    is a symmetry of one already solved is answered without a search.
+    Recently used solutions are kept in memory, and all of them in a
+    dbm file if path is given. """
+
+    def __init__(self, maxsize=10000, path=None, backend="propagate"):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.recent = collections.OrderedDict()
+        self.store = None
+        if path is not None:
+            self.store = dbm.open(path, "c")
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def lookup(self, key):
+        """ Canonical solution for a canonical key, "" if there is no
+        solution, or None if not known """
+        solution = self.recent.get(key)
+        if solution is not None:
+            self.recent.move_to_end(key)
+            return solution
+        if self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                solution = stored.decode("ascii")
+                self.remember(key, solution)
+        return solution
+
+    def remember(self, key, solution):
+        self.recent[key] = solution
+        if len(self.recent) > self.maxsize:
+            self.recent.popitem(last=False)
+
+    def solution(self, lines):
+        """ Return the lines of a solution of a grid, raising
+        UnsolvableGridError if there isn't one """
+        (key, transform) = canonical_form(lines)
+        solution = self.lookup(key)
+        if solution is None:
+            self.misses += 1
+            canonical = sudoku.Sudoku(sudoku.gridStringToLines(key))
+            try:
+                solution = sudoku.linesToGridString(
+                    canonical.solution(backend=self.backend))
+            except sudoku.UnsolvableGridError:
+                solution = ""
+            self.remember(key, solution)
+            if self.store is not None:
+                self.store[key] = solution
+        else:
+            self.hits += 1
+        if solution == "":
+            raise sudoku.UnsolvableGridError("Grid has no solution")
+        return symmetry.apply_transform(sudoku.gridStringToLines(solution),
+                                        symmetry.invert_transform(transform))
@@ -0,0 +1,131 @@
+"""
+Knuth's Algorithm X for exact cover problems, using Dancing Links.
+
+The links are kept in flat lists of node numbers rather than node
+objects: node 0 is the root, nodes 1 to column_count are the column
+headers and every cell of a row added with add_row gets a node after
+those.
+"""
+
+import time
+
+class SearchTimeout(Exception):
+    pass
+
+class ExactCover:
+
+    def __init__(self, column_count):
+        self.column_count = column_count
+        headers = range(0, 1 + column_count)
+        self.left = [ (i - 1) % (1 + column_count) for i in headers ]
+        self.right = [ (i + 1) % (1 + column_count) for i in headers ]
+        self.up = list(headers)
+        self.down = list(headers)
+        self.column = list(headers)
+        self.size = [ 0 for i in headers ]  # nodes in each column
+        self.row_name = [ None for i in headers ]
+        self.partial = []  # names of the rows chosen so far
+        # solutions() raises SearchTimeout if still searching when
+        # time.time() passes the deadline
+        self.deadline = None
+        self.searched = 0  # search tree nodes visited
+
+    def add_row(self, columns, name):
+        """ Add a row with cells in the given columns, numbered from 0.
+        name is what solutions() reports for the row. """
+        first = None
+        for col in columns:
+            header = col + 1
+            node = len(self.column)
+            # Link in at the bottom of the column...
+            self.up.append(self.up[header])
+            self.down.append(header)
+            self.down[self.up[header]] = node
+            self.up[header] = node
+            self.column.append(header)
+            self.size[header] += 1
+            self.row_name.append(name)
+            # ...and at the end of the row
+            if first is None:
+                first = node
+                self.left.append(node)
+                self.right.append(node)
+            else:
+                self.left.append(self.left[first])
+                self.right.append(first)
+                self.right[self.left[first]] = node
+                self.left[first] = node
+
+    def cover(self, header):
+        """ Take a column out of the header list and all the rows
+        that have a cell in it out of the other columns """
+        (left, right, up, down) = (self.left, self.right, self.up, self.down)
+        right[left[header]] = right[header]
+        left[right[header]] = left[header]
+        i = down[header]
+        while i != header:
+            j = right[i]
+            while j != i:
+                down[up[j]] = down[j]
+                up[down[j]] = up[j]
+                self.size[self.column[j]] -= 1
+                j = right[j]
+            i = down[i]
+
+    def uncover(self, header):
+        """ Exactly undo cover(header) """
+        (left, right, up, down) = (self.left, self.right, self.up, self.down)
+        i = up[header]
+        while i != header:
+            j = left[i]
+            while j != i:
+                self.size[self.column[j]] += 1
+                down[up[j]] = j
+                up[down[j]] = j
+                j = left[j]
+            i = up[i]
+        right[left[header]] = header
+        left[right[header]] = header
+
+    def solutions(self):
+        """ Generate every exact cover, as a list of row names. The
+        links are restored when the generator finishes or is closed
+        early, so it can be iterated again. """
+        self.searched += 1
+        if (self.deadline is not None and self.searched % 1024 == 0 and
+            time.time() > self.deadline):
+            raise SearchTimeout("Search ran out of time")
+        if self.right[0] == 0:
+            yield self.partial[:]
+            return
+        # Choose the column with fewest rows left
+        header = self.right[0]
+        best = header
+        while header != 0:
+            if self.size[header] < self.size[best]:
+                best = header
+                if self.size[best] <= 1:
+                    break
+            header = self.right[header]
+        if self.size[best] == 0:
+            return
+        self.cover(best)
+        try:
+            node = self.down[best]
+            while node != best:
+                self.partial.append(self.row_name[node])
+                j = self.right[node]
+                while j != node:
+                    self.cover(self.column[j])
+                    j = self.right[j]
+                try:
+                    yield from self.solutions()
+                finally:
+                    j = self.left[node]
+                    while j != node:
+                        self.uncover(self.column[j])
+                        j = self.left[j]
+                    self.partial.pop()
+                node = self.down[node]
+        finally:
+            self.uncover(best)
@@ -0,0 +1,184 @@
+#!/usr/bin/python3 -u
+
+"""
+Generate sudoku puzzles that have exactly one solution.
+
+A random full grid is made by filling the squares on the diagonal,
+which don't constrain each other, with random permutations, solving
+the rest and putting the result through a random symmetry. Cells are
+then emptied in random order as long as the solution stays unique.
+
+Run as a script to stream puzzles, one compact line each, from a pool
+of worker processes.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+import sudoku
+import symmetry
+
+def random_solution(cardinal_root=3, rng=random):
+    """ Lines of a random full grid """
+    cardinal = cardinal_root * cardinal_root
+    lines = [ [ '.' for c in range(0, cardinal) ] for r in range(0, cardinal) ]
+    for square in range(0, cardinal_root):
+        numbers = list(sudoku.cell_alphabet[:cardinal])
+        rng.shuffle(numbers)
+        for (pos, n) in enumerate(numbers):
+            lines[square * cardinal_root + pos // cardinal_root] \
+                [square * cardinal_root + pos % cardinal_root] = n
+    lines = sudoku.Sudoku(lines).exact_cover_solution()
+    return symmetry.apply_transform(lines, symmetry.random_transform(cardinal_root, rng))
+
+def solution_count(lines, limit=2):
+    """ How many solutions a grid has, counting no further than limit """
+    return sudoku.Sudoku(lines).count_solutions(limit)
+
+def difficulty(lines):
+    """ How many guesses the "propagate" strategy makes to solve a
+    puzzle. 0 means naked and hidden singles are enough. Raises
+    UnsolvableGridError if there is no solution. """
+    s = sudoku.Sudoku(lines)
+    s.start_solving(strategy="propagate")
+    guesses = 0
+    finished = s.is_finished()
+    while not finished:
+        depth = len(s.search_backtracks)
+        try:
+            finished = s.solve()
+        except sudoku.UnsolvableGridError:
+            if not s.has_backtracks():
+                raise
+            s.backtrack()
+            continue
+        if len(s.search_backtracks) > depth:
+            guesses += 1
+    return guesses
+
+def make_puzzle(solution, clues=None, rng=random):
+    """ Empty the cells of a full grid in random order, so long as
+    the solution stays unique, until only clues cells are left or no
+    more can go """
+    s = sudoku.Sudoku(solution)
+    cells = [ (r, c) for r in range(0, s.cardinal) for c in range(0, s.cardinal) ]
+    rng.shuffle(cells)
+    remaining = len(cells)
+    for (r, c) in cells:
+        if clues is not None and remaining <= clues:
+            break
+        n = s.values[s.lines[r][c]]
+        s.remove_number(r, c)
+        if s.count_solutions(limit=2) > 1:
+            s.add_number(r, c, n)
+        else:
+            remaining -= 1
+    return s.lines
+
+def generate_puzzle(cardinal_root=3, clues=None, min_difficulty=0,
+                    max_difficulty=None, attempts=20, rng=random):
+    """ Return (puzzle, solution) lines for a puzzle with a unique
+    solution, at most clues filled cells and a difficulty() in the
+    given range. Returns None if no such puzzle turned up in the
+    given number of attempts. """
+    for i in range(0, attempts):
+        solution = random_solution(cardinal_root, rng)
+        puzzle = make_puzzle(solution, clues, rng)
+        if clues is not None:
+            filled = sum([ len(l) - l.count('.') for l in puzzle ])
+            if filled > clues:
+                continue
+        if min_difficulty > 0 or max_difficulty is not None:
+            d = difficulty(puzzle)
+            if d < min_difficulty or (max_difficulty is not None and d > max_difficulty):
+                continue
+        return (puzzle, solution)
+    return None
+
+def generate_task(seed, options):
+    """ Run generate_puzzle in a worker process """
+    return generate_puzzle(rng=random.Random(seed), **options)
+
+def generate_stream(count, workers=None, rate=None, seed=None, max_failures=10,
+                    **options):
+    """ Generate count (puzzle, solution) pairs on a pool of worker
+    processes. rate caps how many are produced per second. Each puzzle
+    gets its own seed drawn from seed, and they are yielded in the
+    order they were handed out, so a given seed always gives the same
+    puzzles in the same order, however many workers there are. Stops
+    early if max_failures generate_puzzle calls in a row find nothing,
+    as the targets may not be reachable. Other options are passed on
+    to generate_puzzle. """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    seeds = random.Random(seed)
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    in_flight = 4 * workers
+    pending = collections.deque()
+    produced = 0
+    failures = 0
+    start = time.time()
+    try:
+        while produced < count and failures < max_failures:
+            while len(pending) < in_flight:
+                pending.append(pool.submit(generate_task, seeds.getrandbits(64), options))
+            result = pending.popleft().result()
+            if result is None:
+                failures += 1
+                continue
+            failures = 0
+            if rate:
+                delay = start + produced / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            produced += 1
+            yield result
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Print sudoku puzzles with a unique solution, one per line")
+    parser.add_argument("count", type=int, help="how many puzzles")
+    parser.add_argument("--size", type=int, default=3,
+                        help="square size, 3 for 9x9 grids (default)")
+    parser.add_argument("--clues", type=int,
+                        help="at most this many filled cells")
+    parser.add_argument("--min-difficulty", type=int, default=0,
+                        help="at least this many guesses to solve")
+    parser.add_argument("--max-difficulty", type=int,
+                        help="at most this many guesses to solve")
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--rate", type=float, help="puzzles per second")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-failures", type=int, default=10,
+                        help="give up after this many fruitless tries in a row, "
+                             "each of --attempts puzzles")
+    parser.add_argument("--attempts", type=int, default=20,
+                        help="puzzles tried per seed")
+    parser.add_argument("--solutions", action="store_true",
+                        help="print each solution after its puzzle")
+    args = parser.parse_args()
+    produced = 0
+    for (puzzle, solution) in generate_stream(args.count, workers=args.workers,
+                                              rate=args.rate, seed=args.seed,
+                                              max_failures=args.max_failures,
+                                              attempts=args.attempts,
+                                              cardinal_root=args.size,
+                                              clues=args.clues,
+                                              min_difficulty=args.min_difficulty,
+                                              max_difficulty=args.max_difficulty):
+        line = sudoku.linesToGridString(puzzle)
+        if args.solutions:
+            line += " " + sudoku.linesToGridString(solution)
+        sys.stdout.write(line + "\n")
+        produced += 1
+    if produced < args.count:
+        sys.stderr.write("Gave up after %d puzzles: the targets may be out of reach\n" %
+                         produced)
+        sys.exit(1)
@@ -0,0 +1,255 @@
+#!/usr/bin/python3 -u
+
+"""
+A packed binary format for sudoku corpora.
+
+A file is a 16 byte header followed by fixed size records, one per
+grid. The header holds the magic b"SDKP", a format version, the grid
+size (9 for 9x9), the bits per cell and the number of grids, as an
+unsigned little endian 64 bit integer. Each cell is its number, with 0
+for empty, in 4 bits for grids up to 9x9 and in 8 bits for 16x16 and
+25x25, high nibble first, so a 9x9 grid takes 41 bytes. Records are
+padded to a whole byte.
+
+Reader memory maps a file, so any grid can be had by index without
+parsing, as a Sudoku, as an array like those in batch.py or as a view
+of its raw record. Writer writes grids or solutions.
+
+Run as a script to convert between the compact text form, one grid a
+line, and the packed form.
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+import batch
+import sudoku
+
+magic = b"SDKP"
+version = 1
+header = struct.Struct("<4sBBBxQ")
+
+def cell_bits(cardinal):
+    """ Bits used per cell for grids of this size """
+    return 4 if cardinal < 16 else 8
+
+def record_size(cardinal):
+    """ Bytes per grid of this size """
+    return (cardinal * cardinal * cell_bits(cardinal) + 7) // 8
+
+def pack(grids):
+    """ Records for an (N, n, n) array of grids, as an (N, record size)
+    array of bytes """
+    grids = np.asarray(grids)
+    batch.square_size(grids)
+    cardinal = grids.shape[1]
+    if ((grids < 0) | (grids > cardinal)).any():
+        raise ValueError("Numbers out of range for %dx%d grids" % (cardinal, cardinal))
+    cells = grids.reshape((grids.shape[0], cardinal * cardinal)).astype(np.uint8)
+    if cell_bits(cardinal) == 8:
+        return cells
+    if cells.shape[1] % 2 == 1:
+        cells = np.concatenate([ cells, np.zeros((cells.shape[0], 1), np.uint8) ], axis=1)
+    return (cells[:, 0::2] << 4) | cells[:, 1::2]
+
+def unpack(records, cardinal):
+    """ The (N, n, n) int8 array of grids in an (N, record size) array
+    of records """
+    if cell_bits(cardinal) == 8:
+        cells = records
+    else:
+        cells = np.empty((records.shape[0], 2 * records.shape[1]), dtype=np.uint8)
+        cells[:, 0::2] = records >> 4
+        cells[:, 1::2] = records & 0xf
+    cells = cells[:, :cardinal * cardinal].astype(np.int8)
+    return cells.reshape((records.shape[0], cardinal, cardinal))
+
+class Reader:
+    """ The grids of a packed file, memory mapped. Indexing and
+    iterating give Sudoku instances; array() and arrays() unpack grids
+    for batch.py and raw() gives records without copying. """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise IOError("%s is empty, not a packed grid file" % path)
+        if len(self.map) < header.size:
+            self.close()
+            raise IOError("%s is too short for a packed grid file" % path)
+        (file_magic, file_version, self.cardinal, bits, self.count) = \
+            header.unpack_from(self.map)
+        if file_magic != magic or file_version != version:
+            self.close()
+            raise IOError("%s is not a packed grid file" % path)
+        self.record_size = record_size(self.cardinal)
+        if bits != cell_bits(self.cardinal) or \
+           len(self.map) < header.size + self.count * self.record_size:
+            self.close()
+            raise IOError("%s has a bad header or is truncated" % path)
+        self.records = np.frombuffer(self.map, dtype=np.uint8,
+                                     count=self.count * self.record_size,
+                                     offset=header.size)
+        self.records = self.records.reshape((self.count, self.record_size))
+
+    def close(self):
+        # Views into the map must go before it can be closed. If the
+        # caller still holds some from raw(), the map is left to be
+        # closed when the last of them goes.
+        self.records = None
+        if getattr(self, "map", None) is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i):
+        """ The record of grid i, a read-only view into the file """
+        return self.records[i]
+
+    def arrays(self, start=0, stop=None):
+        """ Grids start to stop as an (N, n, n) array """
+        return unpack(self.records[start:stop], self.cardinal)
+
+    def array(self, i):
+        """ Grid i as an (n, n) array """
+        return unpack(self.records[i][None], self.cardinal)[0]
+
+    def lines(self, i):
+        return batch.array_to_lines(self.array(i))
+
+    def __getitem__(self, i):
+        return sudoku.Sudoku(self.lines(i))
+
+    def __iter__(self):
+        for i in range(0, self.count):
+            yield self[i]
+
+class Writer:
+    """ Write grids of one size to a packed file. The count in the
+    header is filled in on close(). """
+
+    def __init__(self, path, cardinal=9):
+        if cardinal not in (4, 9, 16, 25):
+            raise ValueError("Grids of %d rows don't have square sizes" % cardinal)
+        self.cardinal = cardinal
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(header.pack(magic, version, cardinal, cell_bits(cardinal), 0))
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(header.pack(magic, version, self.cardinal,
+                                    cell_bits(self.cardinal), self.count))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_arrays(self, grids):
+        """ Append an (N, n, n) array of grids """
+        grids = np.asarray(grids)
+        if grids.ndim != 3 or grids.shape[1] != self.cardinal:
+            raise ValueError("Expected (N, %d, %d) grids, got shape %s" %
+                             (self.cardinal, self.cardinal, str(grids.shape)))
+        self.file.write(pack(grids).tobytes())
+        self.count += grids.shape[0]
+
+    def write(self, lines):
+        """ Append one grid given as Sudoku lines, such as those of a
+        solution() """
+        self.write_arrays(batch.lines_to_array(lines)[None])
+
+# Cell values by character code, 255 for characters that can't be in a grid
+char_values = np.full(256, 255, dtype=np.uint8)
+char_values[ord(".")] = 0
+for (n, ch) in enumerate(sudoku.cell_alphabet):
+    char_values[ord(ch)] = n + 1
+
+def text_to_packed(infile, path, chunk_size=4096):
+    """ Pack the compact lines of a text file. All grids must be the
+    same size as the first. Returns how many there were. """
+    writer = None
+    chunk = []
+
+    def flush():
+        cells = char_values[np.frombuffer(b"".join(chunk), dtype=np.uint8)]
+        grids = cells.reshape((len(chunk), writer.cardinal, writer.cardinal))
+        if (grids > writer.cardinal).any():
+            bad = np.flatnonzero((grids > writer.cardinal).any(axis=(1, 2)))[0]
+            raise IOError("Bad grid string: '%s'" % chunk[bad].decode("ascii", "replace"))
+        writer.write_arrays(grids)
+        del chunk[:]
+
+    try:
+        for line in infile:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if writer is None:
+                cardinal = int(round(len(line) ** 0.5))
+                if cardinal not in (4, 9, 16, 25):
+                    raise IOError("Bad grid string: '%s'" % line)
+                writer = Writer(path, cardinal)
+            if len(line) != writer.cardinal * writer.cardinal:
+                raise IOError("Bad grid string: '%s'" % line)
+            chunk.append(line.encode("ascii", "replace"))
+            if len(chunk) >= chunk_size:
+                flush()
+        if writer is None:
+            writer = Writer(path)
+        if len(chunk) > 0:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return writer.count
+
+def packed_to_text(path, outfile, chunk_size=4096):
+    """ Write the grids of a packed file as compact lines """
+    with Reader(path) as reader:
+        for start in range(0, len(reader), chunk_size):
+            for grid in reader.arrays(start, start + chunk_size):
+                outfile.write(sudoku.linesToGridString(batch.array_to_lines(grid)) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Convert sudoku grids between compact lines and the packed format")
+    parser.add_argument("input", help="text file of grids, or - for stdin, "
+                                      "or with --unpack a packed file")
+    parser.add_argument("output", help="packed file to write, "
+                                       "or with --unpack a text file or - for stdout")
+    parser.add_argument("--unpack", action="store_true",
+                        help="convert a packed file back to text")
+    args = parser.parse_args()
+    if args.unpack:
+        outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+        packed_to_text(args.input, outfile)
+        outfile.close()
+    else:
+        infile = sys.stdin if args.input == "-" else open(args.input)
+        count = text_to_packed(infile, args.output)
+        sys.stderr.write("Packed %d grids\n" % count)
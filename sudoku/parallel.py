@@ -0,0 +1,182 @@
+#!/usr/bin/python3 -u
+
+"""
+Search one sudoku grid on several cores at once.
+
+The search tree of the "propagate" strategy is split at its first
+choice points: the grid is propagated up to its first guess, and each
+candidate of the guessed cell gives a smaller grid, which is split the
+same way until there are enough of them to keep every worker busy.
+The grids are then searched independently in a pool of worker
+processes. A solution from any of them cancels the rest; when counting
+solutions the workers' counts are added up.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+import sudoku
+
+# Set in each worker to an Event that tells it to stop searching
+cancelled = None
+
+def set_cancel_event(event):
+    global cancelled
+    cancelled = event
+
+def branch(lines):
+    """ Propagate a grid up to its first guess. Returns ("solved",
+    lines), ("dead", None) or ("split", lines of a grid for each
+    candidate of the guessed cell). """
+    s = sudoku.Sudoku(lines)
+    s.start_solving(strategy="propagate")
+    while not s.is_finished():
+        try:
+            s.solve()
+        except sudoku.UnsolvableGridError:
+            return ("dead", None)
+        if s.has_backtracks():
+            children = [ s.state_copy() ]
+            for (r, c, n) in s.search_backtracks[-1][1]:
+                child = s.state_copy()
+                child[r][c] = sudoku.cell_alphabet[n-1]
+                children.append(child)
+            return ("split", children)
+    return ("solved", s.lines)
+
+def split(lines, count):
+    """ Split a grid into at least count grids, between them having
+    the same solutions, unless the search tree is smaller than that.
+    Returns the grids and the solutions found on the way. """
+    frontier = collections.deque([ lines ])
+    solutions = []
+    while 0 < len(frontier) < count:
+        (outcome, found) = branch(frontier.popleft())
+        if outcome == "solved":
+            solutions.append(found)
+        elif outcome == "split":
+            frontier.extend(found)
+    return (list(frontier), solutions)
+
+def search_task(lines, counting, limit):
+    """ Search a grid in a worker. Returns (number of solutions, first
+    solution), counting at most limit solutions, or just the first
+    unless counting. Gives up early if the search is cancelled. """
+    s = sudoku.Sudoku(lines)
+    s.start_solving(strategy="propagate")
+    count = 0
+    first = None
+    moves = 0
+    finished = s.is_finished()
+    while True:
+        if finished:
+            count += 1
+            if first is None:
+                first = s.state_copy()
+            if not counting or (limit is not None and count >= limit):
+                break
+        else:
+            moves += 1
+            if moves % 256 == 0 and cancelled is not None and cancelled.is_set():
+                break
+            try:
+                finished = s.solve()
+                continue
+            except sudoku.UnsolvableGridError:
+                pass
+        if not s.has_backtracks():
+            break
+        s.backtrack()
+        finished = False
+    return (count, first)
+
+def parallel_search(lines, counting=False, limit=None, workers=None, pieces=None):
+    """ Search a grid on a pool of worker processes, see solution()
+    and count_solutions(). Returns (number of solutions, first one).
+    Raises InvalidGridError if the grid contradicts itself. """
+    grid = sudoku.Sudoku(lines)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if pieces is None:
+        pieces = 4 * workers
+    if not counting:
+        limit = 1
+    (grids, solutions) = split(grid.lines, pieces)
+    count = len(solutions)
+    first = solutions[0] if solutions else None
+    if len(grids) == 0 or (limit is not None and count >= limit):
+        return (min(count, limit) if limit is not None else count, first)
+    context = multiprocessing.get_context()
+    event = context.Event()
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=context,
+        initializer=set_cancel_event, initargs=(event,))
+    try:
+        pending = set([ pool.submit(search_task, g, counting, limit) for g in grids ])
+        while pending:
+            (done, pending) = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (found, solution) = future.result()
+                count += found
+                if first is None:
+                    first = solution
+            if limit is not None and count >= limit:
+                break
+    finally:
+        event.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+    if limit is not None:
+        count = min(count, limit)
+    return (count, first)
+
+def solution(lines, workers=None, pieces=None):
+    """ The lines of a solution of a grid, raising InvalidGridError if
+    it contradicts itself and UnsolvableGridError if there just isn't
+    one. pieces is how many grids to split it into, by default four per
+    worker. """
+    (count, first) = parallel_search(lines, workers=workers, pieces=pieces)
+    if first is None:
+        raise sudoku.UnsolvableGridError("Grid has no solution")
+    return first
+
+def count_solutions(lines, limit=None, workers=None, pieces=None):
+    """ How many solutions a grid has, stopping as soon as limit have
+    been found, none if the grid contradicts itself """
+    try:
+        return parallel_search(lines, counting=True, limit=limit, workers=workers,
+                               pieces=pieces)[0]
+    except sudoku.InvalidGridError:
+        return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Solve one sudoku puzzle, one compact line, on all cores")
+    parser.add_argument("puzzle")
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--pieces", type=int,
+                        help="grids to split the search into")
+    parser.add_argument("--count", action="store_true",
+                        help="count the solutions instead")
+    parser.add_argument("--limit", type=int,
+                        help="count no more solutions than this")
+    args = parser.parse_args()
+    start = time.time()
+    lines = sudoku.gridStringToLines(args.puzzle)
+    if args.count:
+        print(count_solutions(lines, limit=args.limit, workers=args.workers,
+                              pieces=args.pieces))
+    else:
+        try:
+            print(sudoku.linesToGridString(solution(lines, workers=args.workers,
+                                                    pieces=args.pieces)))
+        except sudoku.InvalidGridError:
+            print("invalid")
+        except sudoku.UnsolvableGridError:
+            print("unsolvable")
+    sys.stderr.write("Took %.2fs\n" % (time.time() - start))
@@ -0,0 +1,197 @@
+#!/usr/bin/python3 -u
+
+"""
+A resident sudoku solving service.
+
+Clients connect over TCP or a Unix socket and send puzzles one compact
+line each, optionally followed by a space and a time limit in seconds.
+Each gets back a line with the solution or "invalid", "unsolvable" or
+"timeout", as from solve_file.solve_line, or "error" if a worker
+failed or the time limit was negative or not finite, in the order the
+puzzles were sent. Puzzles from all connections share one pool of
+worker processes.
+
+Only so many puzzles are handed to the pool at once; the rest wait
+their turn, and a connection with too many answers outstanding isn't
+read from until some have been sent. A time limit runs from when the
+puzzle arrives, so time spent waiting counts against it. A puzzle that
+is already being solved for someone else, with at least as long to
+do it, isn't solved again: both wait for the same answer.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import math
+import os
+
+import solve_file
+
+class SolveService:
+    """ Solve puzzles on a pool of worker processes for any number of
+    connections, see handle() """
+
+    def __init__(self, workers=None, backend="propagate", timeout=None,
+                 max_pending=None, pipeline=64):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_pending is None:
+            max_pending = 4 * workers
+        # Workers forked from the server would hold on to the sockets
+        # of connections open at the time, keeping them from closing
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        else:
+            context = multiprocessing.get_context("spawn")
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context)
+        self.backend = backend
+        self.timeout = timeout      # default time limit per puzzle
+        self.pipeline = pipeline    # answers outstanding per connection
+        # Puzzles handed to the pool but not finished yet
+        self.slots = asyncio.Semaphore(max_pending)
+        # (future, deadline) of the puzzles being solved, by puzzle line
+        self.in_flight = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def solve(self, line, timeout=None):
+        """ The answer line for one puzzle line """
+        self.requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if timeout is not None:
+            deadline = loop.time() + timeout
+        (shared, shared_deadline) = self.in_flight.get(line, (None, None))
+        if shared is not None and (shared_deadline is None or
+                                   (deadline is not None and shared_deadline >= deadline)):
+            self.coalesced += 1
+        else:
+            # Nothing to share, or it would give up too soon for this one
+            shared = asyncio.ensure_future(self.dispatch(line, deadline))
+            self.in_flight[line] = (shared, deadline)
+
+            def finished(future):
+                if self.in_flight.get(line, (None, None))[0] is future:
+                    del self.in_flight[line]
+
+            shared.add_done_callback(finished)
+        # Others may be waiting for the same answer, so giving up
+        # mustn't cancel it
+        try:
+            if deadline is None:
+                return await asyncio.shield(shared)
+            return await asyncio.wait_for(asyncio.shield(shared),
+                                          max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            return "timeout"
+
+    async def dispatch(self, line, deadline):
+        """ Solve a puzzle in the pool when there is room for it """
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    return "timeout"
+            return await loop.run_in_executor(self.pool, solve_file.solve_line,
+                                              line, self.backend, timeout)
+
+    async def handle(self, reader, writer):
+        """ Serve one connection, as a callback for asyncio.start_server
+        and asyncio.start_unix_server """
+        answers = asyncio.Queue(maxsize=self.pipeline)
+        broken = False
+
+        async def respond():
+            nonlocal broken
+            while True:
+                answer = await answers.get()
+                if answer is None:
+                    break
+                try:
+                    result = await answer
+                except Exception:
+                    result = "error"
+                if broken:
+                    continue
+                try:
+                    writer.write((result + "\n").encode("ascii"))
+                    await writer.drain()
+                except ConnectionError:
+                    broken = True
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            while not broken:
+                request = await reader.readline()
+                if len(request) == 0:
+                    break
+                fields = request.decode("ascii", "replace").split()
+                if len(fields) == 0:
+                    continue
+                try:
+                    timeout = float(fields[1]) if len(fields) > 1 else None
+                except ValueError:
+                    answer = asyncio.get_running_loop().create_future()
+                    answer.set_result("invalid")
+                else:
+                    if timeout is None or (math.isfinite(timeout) and timeout >= 0):
+                        answer = asyncio.ensure_future(self.solve(fields[0], timeout))
+                    else:
+                        answer = asyncio.get_running_loop().create_future()
+                        answer.set_result("error")
+                await answers.put(answer)
+        except ConnectionError:
+            broken = True
+        finally:
+            await answers.put(None)
+            await responder
+            writer.close()
+
+async def serve(service, host="127.0.0.1", port=9999, path=None):
+    """ Listen on a Unix socket at path if given, otherwise on a TCP
+    port, until cancelled """
+    if path is not None:
+        server = await asyncio.start_unix_server(service.handle, path)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Solve sudoku puzzles sent one compact line each over a socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--unix", help="listen on a Unix socket at this path instead")
+    parser.add_argument("--backend", default="propagate",
+                        choices=solve_file.sudoku.solve_backends)
+    parser.add_argument("--timeout", type=float,
+                        help="default seconds allowed for each puzzle")
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--max-pending", type=int,
+                        help="puzzles handed to the workers at once")
+    parser.add_argument("--pipeline", type=int, default=64,
+                        help="answers outstanding per connection")
+    args = parser.parse_args()
+
+    async def main():
+        service = SolveService(workers=args.workers, backend=args.backend,
+                               timeout=args.timeout, max_pending=args.max_pending,
+                               pipeline=args.pipeline)
+        try:
+            await serve(service, args.host, args.port, args.unix)
+        finally:
+            service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,114 @@
+#!/usr/bin/python3 -u
+
+"""
+Solve a file of sudoku puzzles on all cores.
+
+Puzzles are read one per line in the compact form, such as 81
+characters for 9x9, from a file or stdin, and handed out in chunks to
+a pool of worker processes. Only a bounded number of chunks are in
+flight at once, so a corpus of any size streams through in constant
+memory. Each solution is written as a compact line, or one of
+"invalid", "unsolvable" or "timeout", either in input order or, with
+--unordered, as soon as it is ready and prefixed by its line number.
+With --stats each line also gets the counts of its search, to pick out
+the puzzles that are hard work.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import os
+import sys
+
+import sudoku
+
+def solve_line(line, backend="propagate", timeout=None, stats=False):
+    """ The output line for one puzzle line, followed by the counts
+    of a SolverStats if stats is true """
+    solver_stats = sudoku.SolverStats() if stats else None
+    try:
+        s = sudoku.Sudoku(sudoku.gridStringToLines(line))
+        result = sudoku.linesToGridString(s.solution(backend=backend, timeout=timeout,
+                                                     stats=solver_stats))
+    except (IOError, sudoku.InvalidGridError):
+        result = "invalid"
+    except sudoku.SolveTimeoutError:
+        result = "timeout"
+    except sudoku.UnsolvableGridError:
+        result = "unsolvable"
+    if solver_stats is not None:
+        result += " " + str(solver_stats)
+    return result
+
+def solve_chunk(chunk, backend, timeout, stats=False):
+    """ Solve a list of (line number, puzzle line) in a worker """
+    return [ (number, solve_line(line, backend, timeout, stats))
+             for (number, line) in chunk ]
+
+def solve_stream(lines, backend="propagate", timeout=None, workers=None,
+                 ordered=True, chunk_size=64, in_flight=None, stats=False):
+    """ Generate (line number, output line) for each non-blank line
+    of puzzles, numbered from 1. lines is read lazily, and at most
+    in_flight chunks of chunk_size puzzles are being solved at once.
+    With stats, each output line ends with the counts of its search. """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if in_flight is None:
+        in_flight = 4 * workers
+    numbered = ((number, line.strip()) for (number, line) in enumerate(lines, 1)
+                if len(line.strip()) > 0)
+    chunks = iter(lambda: list(itertools.islice(numbered, chunk_size)), [])
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        if ordered:
+            pending = collections.deque()
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    pending.append(pool.submit(solve_chunk, chunk, backend, timeout, stats))
+                while pending and (chunk is None or len(pending) >= in_flight):
+                    for result in pending.popleft().result():
+                        yield result
+        else:
+            pending = set()
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    pending.add(pool.submit(solve_chunk, chunk, backend, timeout, stats))
+                while pending and (chunk is None or len(pending) >= in_flight):
+                    (done, pending) = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        for result in future.result():
+                            yield result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=
+        "Solve sudoku puzzles, one compact line each")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="file of puzzles, or - for stdin (default)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file for solutions, or - for stdout (default)")
+    parser.add_argument("--backend", default="propagate",
+                        choices=sudoku.solve_backends)
+    parser.add_argument("--timeout", type=float,
+                        help="seconds to spend on each puzzle")
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="puzzles per job sent to a worker")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write solutions as they are ready, numbered")
+    parser.add_argument("--stats", action="store_true",
+                        help="follow each solution with counts of its search")
+    args = parser.parse_args()
+    infile = sys.stdin if args.input == "-" else open(args.input)
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    for (number, result) in solve_stream(infile, backend=args.backend,
+                                         timeout=args.timeout,
+                                         workers=args.workers,
+                                         ordered=not args.unordered,
+                                         chunk_size=args.chunk_size,
+                                         stats=args.stats):
+        if args.unordered:
+            outfile.write("%d %s\n" % (number, result))
+        else:
+            outfile.write(result + "\n")
+    outfile.close()
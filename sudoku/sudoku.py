@@ -5,64 +5,166 @@ import re
 import sys
 import time
 
+import dlx
+
 grid_string_re = re.compile("^[1-9.]{9}$")
 
+# Numbers 1 upwards are written with these characters, so grids can
+# have up to 25 x 25 cells with 5 x 5 squares
+cell_alphabet = "123456789ABCDEFGHIJKLMNOP"
+# Row and column labels when printing a grid
+index_alphabet = "0123456789abcdefghijklmno"
+
 class UnsolvableGridError(Exception):
     pass
 
 class InvalidGridError(Exception):
     pass
 
+class SolveTimeoutError(UnsolvableGridError):
+    """ A search ran out of time before finding a solution """
+    pass
+
+def gridLineRe(cardinal):
+    """ Regular expression for one line of a cardinal x cardinal grid """
+    if cardinal == 9:
+        return grid_string_re
+    return re.compile("^[%s.]{%d}$" % (cell_alphabet[:cardinal], cardinal))
+
 def gridStringToLines(grid_string):
-    """ Convert a simple string for 9x9 sudoku to lines """
+    """ Convert a simple string for sudoku to lines. The grid size
+    comes from the length of the first line, so 9x9 grids use 1-9
+    and 16x16 grids 1-9 and A-G, for instance. A grid can also be
+    given compactly as a single line, such as 81 characters for
+    9x9. """
+    rows = [ line.strip() for line in grid_string.split("\n") ]
+    rows = [ line for line in rows if len(line) > 0 ]
+    if len(rows) == 1:
+        cardinal = int(round(len(rows[0]) ** 0.5))
+        if cardinal * cardinal == len(rows[0]):
+            rows = [ rows[0][i:i+cardinal] for i in range(0, len(rows[0]), cardinal) ]
     lines = []
-    for line in grid_string.split("\n"):
-        line.strip()
-        if len(line) <= 0:
-            continue
-        if grid_string_re.match(line) is None:
+    line_re = None
+    for line in rows:
+        if line_re is None:
+            line_re = gridLineRe(len(line))
+        if line_re.match(line) is None:
             raise IOError("Bad grid string: '%s'" % line)
         lines.append(list(line))
     return lines
 
+def linesToGridString(lines):
+    """ The compact single line form of a grid """
+    return "".join([ "".join(l) for l in lines ])
+
+class SolverStats:
+    """ Counters for a search, filled in by a Sudoku that has been
+    instrument()ed or by solution(stats=...) """
+
+    phases = ["propagate", "guess", "backtrack"]
+
+    def __init__(self):
+        self.moves = 0         # numbers placed by solve()
+        self.propagations = 0  # moves with no other choice
+        self.guesses = 0       # moves picked from several candidates
+        self.backtracks = 0
+        self.dead_ends = 0     # calls to solve() that found no move
+        self.max_depth = 0     # most guesses open at once
+        self.nodes = 0         # search tree nodes, for the "dlx" backend
+        # Seconds spent in solve() finding forced moves or guesses,
+        # and in backtrack()
+        self.times = dict((phase, 0.0) for phase in self.phases)
+
+    def __str__(self):
+        counts = ("moves=%d propagations=%d guesses=%d backtracks=%d "
+                  "dead_ends=%d max_depth=%d nodes=%d" %
+                  (self.moves, self.propagations, self.guesses, self.backtracks,
+                   self.dead_ends, self.max_depth, self.nodes))
+        return counts + "".join([ " %s=%.4fs" % (phase, self.times[phase])
+                                  for phase in self.phases ])
+
+def print_place(s, r, c, n):
+    print("Add '%s' to row %d, col %d" % (cell_alphabet[n-1], r, c))
+
+def print_guess(s, r, c, n):
+    print("Guessed '%s' in row %d, col %d" % (cell_alphabet[n-1], r, c))
+
+def print_backtrack(s):
+    print("Restored state, next guess is %s" % str(s.next_guess))
+    print(s)
+
+# Ways of choosing moves, see Sudoku.start_solving
+solve_strategies = ["heuristic", "propagate"]
+
+# Ways of finding a whole solution, see Sudoku.solution
+solve_backends = solve_strategies + ["dlx"]
+
+# Cell tables for each square size, see Sudoku.compute_geometry
+geometry_cache = {}
+
+def mask_positions(mask):
+    """ The indices of the bits set in mask, lowest first """
+    positions = []
+    while mask:
+        low = mask & -mask
+        positions.append(low.bit_length() - 1)
+        mask ^= low
+    return positions
+
+def mask_numbers(mask):
+    """ The numbers in a mask where bit n-1 stands for number n """
+    return [ p + 1 for p in mask_positions(mask) ]
+
 class Sudoku:
     
     def __init__(self,grid_desc,verbose=False):
         self.lines = []
         self.verbose = verbose
+        # Search state, see start_solving
+        self.strategy = "heuristic"
+        self.search_backtracks = []
+        self.next_guess = None
+        self.trail = None  # only kept while solving
         if type(grid_desc) == type("foo"):
             self.lines = gridStringToLines(grid_desc)
         elif type(grid_desc) == type([]):
             self.lines = [ x[:] for x in grid_desc ] 
-        if len(self.lines) != 9:
-            raise IOError("Found %d grid rows, not 9" % len(self.lines))
-        self.cardinal = 9  # 9 x 9 grid, 3 x 3 squares, numbers 1-9
-        self.cardinal_root = 3
+        # 9 x 9 grid, 3 x 3 squares, numbers 1-9, or bigger
+        self.cardinal = len(self.lines)
+        self.cardinal_root = int(round(self.cardinal ** 0.5))
+        if (self.cardinal_root * self.cardinal_root != self.cardinal or
+            self.cardinal_root < 2 or self.cardinal > len(cell_alphabet)):
+            raise IOError("Found %d grid rows, not 4, 9, 16 or 25" % len(self.lines))
+        for l in self.lines:
+            if len(l) != self.cardinal:
+                raise IOError("Found a grid row of %d cells, not %d" %
+                              (len(l), self.cardinal))
+        self.compute_geometry()
         self.original_lines = self.lines[:]
         self.compute_groups()
         if not self.is_valid():
             raise InvalidGridError("Input grid is invalid")
+        if verbose:
+            self.instrument(on_place=print_place, on_guess=print_guess,
+                            on_backtrack=print_backtrack)
 
     def __str__(self):
+        root = self.cardinal_root
+        border = "  +" + ("-" * (2 * root + 1) + "+") * root + "\n"
         counter = 0
         ans = ''
         for l in self.lines:
-            if counter % self.cardinal_root == 0:
-                ans += "  +"
-                for i in range(0, self.cardinal_root):
-                    ans += "-------+"
-                ans += "\n"
-            ans += "%d |" % counter
-            for i in range(0, self.cardinal_root):
-                offset = self.cardinal_root * i
-                ans += " %s %s %s |" % (l[offset], l[offset+1], l[offset+2])
+            if counter % root == 0:
+                ans += border
+            ans += "%s |" % index_alphabet[counter]
+            for i in range(0, root):
+                offset = root * i
+                ans += " %s |" % " ".join(l[offset:offset+root])
             ans +=" \n"
             counter += 1
-        ans += "  +"
-        for i in range(0, self.cardinal_root):
-            ans += "-------+"
-        ans += "\n"
-        ans += "    0 1 2 | 3 4 5 | 6 7 8\n"
+        ans += border
+        ans += "    %s\n" % " | ".join([ " ".join(index_alphabet[i*root:(i+1)*root])
+                                          for i in range(0, root) ])
         return ans
 
     def state_copy(self):
@@ -79,68 +181,227 @@ class Sudoku:
         square_col = int(col_idx / self.cardinal_root)
         square_row = int(row_idx / self.cardinal_root)
         return square_col + (self.cardinal_root * square_row)
-        
+
+    def compute_geometry(self):
+        """ Tables that only depend on the grid size, shared by every
+        grid of that size. Cells are numbered row by row, so cell
+        (r, c) is r * cardinal + c. """
+        root = self.cardinal_root
+        self.full_mask = (1 << self.cardinal) - 1
+        self.values = dict((cell_alphabet[n-1], n) for n in range(1, 1+self.cardinal))
+        tables = geometry_cache.get(root)
+        if tables is None:
+            cell_row = []
+            cell_col = []
+            cell_square = []
+            cell_square_pos = []  # position within the square, row by row
+            for r in range(0, self.cardinal):
+                for c in range(0, self.cardinal):
+                    cell_row.append(r)
+                    cell_col.append(c)
+                    cell_square.append(self.square_from_rowcol(r, c))
+                    cell_square_pos.append((r % root) * root + c % root)
+            # Every other cell sharing a row, column or square with each cell
+            peers = []
+            for idx in range(0, len(cell_row)):
+                (r, c, s) = (cell_row[idx], cell_col[idx], cell_square[idx])
+                peers.append([ p for p in range(0, len(cell_row))
+                               if p != idx and (cell_row[p] == r or
+                                                cell_col[p] == c or
+                                                cell_square[p] == s) ])
+            # The cells making up each row, column and square
+            row_cells = [ [ idx for idx in range(0, len(cell_row)) if cell_row[idx] == g ]
+                          for g in range(0, self.cardinal) ]
+            col_cells = [ [ idx for idx in range(0, len(cell_row)) if cell_col[idx] == g ]
+                          for g in range(0, self.cardinal) ]
+            square_cells = [ [ idx for idx in range(0, len(cell_row)) if cell_square[idx] == g ]
+                             for g in range(0, self.cardinal) ]
+            tables = (cell_row, cell_col, cell_square, cell_square_pos, peers,
+                      row_cells, col_cells, square_cells)
+            geometry_cache[root] = tables
+        (self.cell_row, self.cell_col, self.cell_square,
+         self.cell_square_pos, self.peers,
+         self.row_cells, self.col_cells, self.square_cells) = tables
+
     def compute_groups(self):
-        """ Compile the set of known numbers in rows, columns and squares.
-        Does not include unknown values. """
-        self.row_nums = []
-        self.col_nums = [ set() for i in range(0, self.cardinal) ]
-        self.square_nums = [ set() for i in range(0, self.cardinal) ]
-        self.empty_cells = []  # row, col, sq
-        row_idx = 0
+        """ Rebuild the bitmasks of known numbers in rows, columns and
+        squares, and the candidate mask of every cell, from scratch.
+        Bit n-1 of a mask stands for number n. Only needed when the
+        grid is changed wholesale; add_number and remove_number keep
+        everything up to date incrementally. """
+        cardinal = self.cardinal
+        self.row_mask = [ 0 for i in range(0, cardinal) ]
+        self.col_mask = [ 0 for i in range(0, cardinal) ]
+        self.square_mask = [ 0 for i in range(0, cardinal) ]
+        # Which cells are still empty: columns of a row, rows of a
+        # column and positions within a square
+        self.row_blanks = [ 0 for i in range(0, cardinal) ]
+        self.col_blanks = [ 0 for i in range(0, cardinal) ]
+        self.square_blanks = [ 0 for i in range(0, cardinal) ]
+        self.row_missing = [ 0 for i in range(0, cardinal) ]
+        self.col_missing = [ 0 for i in range(0, cardinal) ]
+        self.square_missing = [ 0 for i in range(0, cardinal) ]
+        self.empty_count = 0
+        # Number of times a number was found already in its group
+        self.conflicts = 0
+        idx = 0
         for l in self.lines:
-            ns = [ int(c) for c in l if not c == '.' ]
-            self.row_nums.append(set(ns))
-            for col_idx in range(0, self.cardinal):
-                square_idx = self.square_from_rowcol(row_idx, col_idx)
-                try:
-                    n = int(l[col_idx])
-                except ValueError:
+            for ch in l:
+                n = self.values.get(ch)
+                if n is None:
                     # Don't know what this number is yet
-                    self.empty_cells.append( (row_idx, col_idx, square_idx) )
-                    continue
-                self.col_nums[col_idx].add(n)
-                self.square_nums[square_idx].add(n)
-            row_idx += 1
-        # Compute empty squares in rows, cols, idx
-        self.row_missing = [ 0 for i in range(0, self.cardinal) ]
-        self.col_missing = [ 0 for i in range(0, self.cardinal) ]
-        self.square_missing = [ 0 for i in range(0, self.cardinal) ]
-        for (r,c,s) in self.empty_cells:
-            self.row_missing[r] += 1
-            self.col_missing[c] += 1
-            self.square_missing[s] += 1
-
-    def start_solving(self):
-        self.search_backtracks = []
+                    self.mark_empty(idx)
+                else:
+                    self.mark_filled(idx, 1 << (n-1))
+                idx += 1
+        self.candidates = [ 0 for i in range(0, idx) ]
+        # Empty cells with one candidate or none, see propagate()
+        self.singles = []
+        for idx in range(0, len(self.candidates)):
+            if self.lines[self.cell_row[idx]][self.cell_col[idx]] not in self.values:
+                self.candidates[idx] = self.cell_candidates(idx)
+                if self.candidates[idx] & (self.candidates[idx] - 1) == 0:
+                    self.singles.append(idx)
+
+    def mark_empty(self, idx):
+        (r, c, s) = (self.cell_row[idx], self.cell_col[idx],
+                     self.cell_square[idx])
+        self.row_blanks[r] |= 1 << c
+        self.col_blanks[c] |= 1 << r
+        self.square_blanks[s] |= 1 << self.cell_square_pos[idx]
+        self.row_missing[r] += 1
+        self.col_missing[c] += 1
+        self.square_missing[s] += 1
+        self.empty_count += 1
+
+    def mark_filled(self, idx, bit):
+        (r, c, s) = (self.cell_row[idx], self.cell_col[idx],
+                     self.cell_square[idx])
+        if self.row_mask[r] & bit:
+            self.conflicts += 1
+            if self.verbose:
+                print("Duplicate numbers in row %d" % r)
+        if self.col_mask[c] & bit:
+            self.conflicts += 1
+            if self.verbose:
+                print("Duplicate numbers in column %d" % c)
+        if self.square_mask[s] & bit:
+            self.conflicts += 1
+            if self.verbose:
+                print("Duplicate numbers in square %d" % s)
+        self.row_mask[r] |= bit
+        self.col_mask[c] |= bit
+        self.square_mask[s] |= bit
+
+    def cell_candidates(self, idx):
+        """ Mask of the numbers that could still go in a cell """
+        return self.full_mask & ~(self.row_mask[self.cell_row[idx]] |
+                                  self.col_mask[self.cell_col[idx]] |
+                                  self.square_mask[self.cell_square[idx]])
+
+    def start_solving(self, strategy="heuristic"):
+        """ Get ready to call solve() repeatedly. The strategy is
+        "heuristic", which fills in groups with few blanks first, or
+        "propagate", which fills in naked and hidden singles and
+        otherwise branches on the cell with fewest candidates. """
+        if strategy not in solve_strategies:
+            raise ValueError("Unknown solve strategy '%s'" % strategy)
+        self.strategy = strategy
+        self.search_backtracks = []  # (trail length, guesses left)
         self.next_guess = None
+        # Cells filled since solving started, in order, so that a
+        # backtrack only has to undo what changed since its guess
+        self.trail = []
 
     def has_backtracks(self):
         return len(self.search_backtracks) > 0
 
     def backtrack(self):
         # Pop off last backtrack + guess
-        (state, guess_list) = self.search_backtracks[-1]
-        self.next_guess = guess_list[0]
-        if len(guess_list) > 1:
-            self.search_backtracks[-1] = (state, guess_list[1:])
-        else:
-            self.search_backtracks = self.search_backtracks[0:-1]
+        (mark, guess_list) = self.search_backtracks[-1]
+        self.next_guess = guess_list.pop(0)
+        if len(guess_list) == 0:
+            self.search_backtracks.pop()
         # Restore state to last backtrack point, try again
-        if self.verbose:
-            print("Restoring state from:")
-            print(self)
-        self.lines = state
-        self.compute_groups()
-        if self.verbose:
-            print(self)
-            print("Restored state, next guess is %s" % str(self.next_guess))
+        self.undo_to(mark)
+        # Nothing was queued when the guess was made
+        self.singles = []
+
+    def instrument(self, stats=None, on_place=None, on_guess=None,
+                   on_backtrack=None):
+        """ Watch the search: count what solve() and backtrack() do in
+        stats, a SolverStats, and call on_place(self, r, c, n) for
+        every move solve() makes, on_guess(self, r, c, n) as well when
+        the move was a guess, and on_backtrack(self) after each
+        backtrack. This wraps solve() and backtrack() for this grid
+        only, so a grid that isn't instrumented pays nothing for it.
+        Calling it with no arguments takes the wrappers off again. """
+        self.__dict__.pop("solve", None)
+        self.__dict__.pop("backtrack", None)
+        if stats is None and on_place is None and on_guess is None and \
+           on_backtrack is None:
+            return
+        (plain_solve, plain_backtrack) = (self.solve, self.backtrack)
+        clock = time.perf_counter
+
+        def solve():
+            guessing = self.next_guess is not None
+            depth = len(self.search_backtracks)
+            start = clock()
+            try:
+                finished = plain_solve()
+            except UnsolvableGridError:
+                if stats is not None:
+                    stats.dead_ends += 1
+                    stats.times["propagate"] += clock() - start
+                raise
+            depth_now = len(self.search_backtracks)
+            guessing = guessing or depth_now > depth
+            if stats is not None:
+                stats.times["guess" if guessing else "propagate"] += clock() - start
+                stats.moves += 1
+                if guessing:
+                    stats.guesses += 1
+                else:
+                    stats.propagations += 1
+                if depth_now > stats.max_depth:
+                    stats.max_depth = depth_now
+            if on_place is not None or (guessing and on_guess is not None):
+                idx = self.trail[-1]
+                (r, c) = (self.cell_row[idx], self.cell_col[idx])
+                n = self.values[self.lines[r][c]]
+                if on_place is not None:
+                    on_place(self, r, c, n)
+                if guessing and on_guess is not None:
+                    on_guess(self, r, c, n)
+            return finished
+
+        def backtrack():
+            start = clock()
+            plain_backtrack()
+            if stats is not None:
+                stats.backtracks += 1
+                stats.times["backtrack"] += clock() - start
+            if on_backtrack is not None:
+                on_backtrack(self)
+
+        self.solve = solve
+        self.backtrack = backtrack
+
+    def undo_to(self, mark):
+        """ Empty the cells filled since the trail was mark long """
+        trail = self.trail
+        while len(trail) > mark:
+            idx = trail.pop()
+            self.remove_number(self.cell_row[idx], self.cell_col[idx])
 
     def solve(self):
         # Any pending guesses?
         if self.next_guess:
             (r, c, n) = self.next_guess
             self.next_guess = None
+        elif self.strategy == "propagate":
+            (r, c, n) = self.propagate()
         else:
             # Look for groups with 1, then 2, then 3 missing
             for max_choose in range(1,4):                
@@ -157,42 +418,254 @@ class Sudoku:
         self.add_number(r, c, n)
         return self.is_finished()
 
+    def propagate(self):
+        """ Find the next move for the "propagate" strategy: a cell
+        with only one candidate left, else a number with only one
+        place left in a group, else a guess at the cell with the
+        fewest candidates. """
+        candidates = self.candidates
+        # Cells that got down to one candidate (or none) as their
+        # peers were filled in
+        while self.singles:
+            idx = self.singles.pop()
+            (r, c) = (self.cell_row[idx], self.cell_col[idx])
+            if self.lines[r][c] in self.values:
+                continue
+            possibles = candidates[idx]
+            if possibles == 0:
+                raise UnsolvableGridError("Nothing fits in row %d, col %d" % (r, c))
+            if possibles & (possibles - 1) == 0:
+                return (r, c, possibles.bit_length())
+        move = self.hidden_single()
+        if move is not None:
+            return move
+        # Branch on the cell with the minimum remaining values
+        best = None
+        best_count = self.cardinal + 1
+        for r in range(0, self.cardinal):
+            first = r * self.cardinal
+            for c in mask_positions(self.row_blanks[r]):
+                count = candidates[first + c].bit_count()
+                if count < best_count:
+                    (best, best_count) = (first + c, count)
+                    if count <= 1:
+                        break
+            if best_count <= 1:
+                break
+        if best is None:
+            raise UnsolvableGridError("Can't find any more moves")
+        (r, c) = (self.cell_row[best], self.cell_col[best])
+        if best_count == 0:
+            raise UnsolvableGridError("Nothing fits in row %d, col %d" % (r, c))
+        possibles = mask_numbers(candidates[best])
+        if len(possibles) > 1:
+            self.search_backtracks.append(
+                (len(self.trail), [ (r,c,p) for p in possibles[1:] ])
+                )
+        return (r, c, possibles[0])
+
+    def hidden_single(self):
+        """ Find a number that can only go in one cell of some row,
+        column or square """
+        candidates = self.candidates
+        for (group_masks, group_cells) in [(self.row_mask, self.row_cells),
+                                           (self.col_mask, self.col_cells),
+                                           (self.square_mask, self.square_cells)]:
+            for g in range(0, self.cardinal):
+                missing = self.full_mask & ~group_masks[g]
+                if missing == 0:
+                    continue
+                # Numbers seen in at least one, and at least two, cells
+                once = 0
+                twice = 0
+                for idx in group_cells[g]:
+                    twice |= once & candidates[idx]
+                    once |= candidates[idx]
+                if missing & ~once:
+                    raise UnsolvableGridError("Nowhere to put %s in a group" %
+                                              mask_numbers(missing & ~once))
+                hidden = missing & once & ~twice
+                if hidden:
+                    bit = hidden & -hidden
+                    for idx in group_cells[g]:
+                        if candidates[idx] & bit:
+                            return (self.cell_row[idx], self.cell_col[idx],
+                                    bit.bit_length())
+        return None
+
+    def count_solutions(self, limit=None):
+        """ How many solutions the grid has, stopping as soon as limit
+        have been found. This runs the "propagate" search on the grid
+        itself, backtracking after each solution as after a dead end,
+        and undoes all its moves at the end, so the grid and any
+        search in progress are left as they were. """
+        if not self.is_valid():
+            return 0
+        saved = (self.strategy, self.search_backtracks, self.next_guess,
+                 self.trail)
+        self.start_solving(strategy="propagate")
+        count = 0
+        finished = self.is_finished()
+        try:
+            while True:
+                if finished:
+                    count += 1
+                    if limit is not None and count >= limit:
+                        break
+                else:
+                    try:
+                        finished = self.solve()
+                        continue
+                    except UnsolvableGridError:
+                        pass
+                if not self.has_backtracks():
+                    break
+                self.backtrack()
+                finished = False
+        finally:
+            self.undo_to(0)
+            self.singles = []
+            (self.strategy, self.search_backtracks, self.next_guess,
+             self.trail) = saved
+        return count
+
+    def solution(self, backend="propagate", tolerance=None, timeout=None,
+                 stats=None):
+        """ Return the lines of a solution, leaving this grid as it is.
+        backend is one of the solve strategies, which searches with
+        solve() and backtrack() and gives up after tolerance moves if
+        given, or "dlx" for an exact cover search. Either way the
+        search raises SolveTimeoutError after timeout seconds. The
+        search is counted in stats, a SolverStats, if given. """
+        if backend not in solve_backends:
+            raise ValueError("Unknown solver backend '%s'" % backend)
+        if not self.is_valid():
+            raise InvalidGridError("Input grid is invalid")
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        if backend == "dlx":
+            return self.exact_cover_solution(deadline, stats)
+        s = Sudoku(self.lines)
+        if stats is not None:
+            s.instrument(stats)
+        s.start_solving(strategy=backend)
+        moves = 0
+        finished = s.is_finished()
+        while not finished:
+            if tolerance is not None and moves >= tolerance:
+                raise UnsolvableGridError("Giving up after %d moves" % moves)
+            if deadline is not None and moves % 256 == 0 and time.time() > deadline:
+                raise SolveTimeoutError("Giving up after %.1fs" % timeout)
+            moves += 1
+            try:
+                finished = s.solve()
+            except UnsolvableGridError:
+                if not s.has_backtracks():
+                    raise
+                s.backtrack()
+        return s.lines
+
+    def exact_cover_solution(self, deadline=None, stats=None):
+        """ Solve as an exact cover problem with Dancing Links """
+        for lines in self.exact_cover_solutions(deadline, stats):
+            return lines
+        raise UnsolvableGridError("Grid has no solution")
+
+    def exact_cover_solutions(self, deadline=None, stats=None):
+        """ Generate the lines of every solution with Dancing Links,
+        raising SolveTimeoutError if the search is still going at the
+        time.time() deadline, and counting search tree nodes in stats
+        if given. There is a column for each cell, and for each number
+        in each row, column and square, and a matrix row for each
+        number that could go in each cell. """
+        cells = self.cardinal * self.cardinal
+        cover = dlx.ExactCover(4 * cells)
+        cover.deadline = deadline
+        for idx in range(0, cells):
+            (r, c, s) = (self.cell_row[idx], self.cell_col[idx],
+                         self.cell_square[idx])
+            n = self.values.get(self.lines[r][c])
+            if n is None:
+                numbers = mask_numbers(self.candidates[idx])
+            else:
+                numbers = [ n ]
+            for n in numbers:
+                cover.add_row([ idx,
+                                cells + r * self.cardinal + n - 1,
+                                2 * cells + c * self.cardinal + n - 1,
+                                3 * cells + s * self.cardinal + n - 1 ],
+                              (r, c, n))
+        try:
+            for rows in cover.solutions():
+                lines = self.state_copy()
+                for (r, c, n) in rows:
+                    lines[r][c] = cell_alphabet[n-1]
+                yield lines
+        except dlx.SearchTimeout:
+            raise SolveTimeoutError("Giving up at the deadline")
+        finally:
+            if stats is not None:
+                stats.nodes += cover.searched
+
     def is_finished(self):
         """ We are finished if we have no empty cells left """
-        return len(self.empty_cells) == 0
+        return self.empty_count == 0
 
     def is_valid(self):
         """ If we have any duplicate numbers in a row, square
         or column then our grid is not valid. """
-        for r in range(0, self.cardinal):
-            ns = len(self.row_nums[r])
-            ms = len([1 for (rc,c,s) in self.empty_cells if rc == r])
-            if ns + ms < self.cardinal:
-                if self.verbose:
-                    print("Duplicate numbers in row %d" % r)
-                return False
-        for c in range(0, self.cardinal):
-            ns = len(self.col_nums[c])
-            ms = len([1 for (r,cc,s) in self.empty_cells if cc == c])
-            if ns + ms < self.cardinal:
-                if self.verbose:
-                    print("Duplicate numbers in column %d" % c)
-                return False
-        for s in range(0, self.cardinal):
-            ns = len(self.square_nums[s])
-            ms = len([1 for (r,c,sc) in self.empty_cells if sc == s])
-            if ns + ms < self.cardinal:
-                if self.verbose:
-                    print("Duplicate numbers in square %d" % s)
-                return False
-        # All kosher
-        return True
+        return self.conflicts == 0
         
     def add_number(self, r, c, n):
-        if self.verbose:
-            print("Add '%d' to row %d, col %d" % (n, r, c))
-        self.lines[r][c] = "%d" % n
-        self.compute_groups()
+        if self.lines[r][c] in self.values:
+            self.remove_number(r, c)
+        idx = r * self.cardinal + c
+        bit = 1 << (n-1)
+        s = self.cell_square[idx]
+        self.mark_filled(idx, bit)
+        self.row_blanks[r] &= ~(1 << c)
+        self.col_blanks[c] &= ~(1 << r)
+        self.square_blanks[s] &= ~(1 << self.cell_square_pos[idx])
+        self.row_missing[r] -= 1
+        self.col_missing[c] -= 1
+        self.square_missing[s] -= 1
+        self.empty_count -= 1
+        self.lines[r][c] = cell_alphabet[n-1]
+        if self.trail is not None:
+            self.trail.append(idx)
+        # Nobody else in the row, column or square can have n now
+        candidates = self.candidates
+        candidates[idx] = 0
+        for p in self.peers[idx]:
+            possibles = candidates[p]
+            if possibles & bit:
+                possibles ^= bit
+                candidates[p] = possibles
+                if possibles & (possibles - 1) == 0:
+                    self.singles.append(p)
+
+    def remove_number(self, r, c):
+        """ Empty a filled cell again """
+        if self.conflicts:
+            # The masks can't tell which copy of a duplicate we remove
+            self.lines[r][c] = '.'
+            self.compute_groups()
+            return
+        idx = r * self.cardinal + c
+        bit = 1 << (self.values[self.lines[r][c]] - 1)
+        s = self.cell_square[idx]
+        self.row_mask[r] &= ~bit
+        self.col_mask[c] &= ~bit
+        self.square_mask[s] &= ~bit
+        self.mark_empty(idx)
+        self.lines[r][c] = '.'
+        # Peers may have got n back as a candidate
+        candidates = self.candidates
+        candidates[idx] = self.cell_candidates(idx)
+        for p in self.peers[idx]:
+            if self.lines[self.cell_row[p]][self.cell_col[p]] not in self.values:
+                candidates[p] = self.cell_candidates(p)
     
     def solve_at(self, num_missing, choose_max=1):
         # Do we have any rows, cols, squares with the given
@@ -200,79 +673,63 @@ class Sudoku:
         move = None
         for row_idx in range(0, self.cardinal):
             if self.row_missing[row_idx] == num_missing:
-                if self.verbose:
-                    print("Row %d has exactly %d missing" % (row_idx, num_missing))
                 move = self.guess_row(row_idx, num_missing, choose_max)
                 if move is not None: return move
         for col_idx in range(0, self.cardinal):
             if self.col_missing[col_idx] == num_missing:
-                if self.verbose:
-                    print("Col %d has exactly %d missing" % (col_idx, num_missing))
                 move = self.guess_col(col_idx, num_missing, choose_max)
                 if move is not None: return move
         for square_idx in range(0, self.cardinal):
             if self.square_missing[square_idx] == num_missing:
-                if self.verbose:
-                    print("Square %d has exactly %d missing" % (square_idx, num_missing))
                 move = self.guess_square(square_idx, num_missing, choose_max)
                 if move is not None: return move
         return None
 
-    def missing_numbers(self, present_set):
-        """ The set of numbers not present """
-        return set(range(1,(1+self.cardinal))) - present_set
+    def missing_numbers(self, present_mask):
+        """ Mask of the numbers not present """
+        return self.full_mask & ~present_mask
 
     def guess_row(self, row_idx, num_missing, choose_max):
-        # Find the missing numbers from that row, and what col, square they are in
-        missing_places = [ (r,c,s) for (r,c,s) in self.empty_cells if r == row_idx ]
-        missing_row_numbers = self.missing_numbers(self.row_nums[row_idx])
+        # Find the missing numbers from that row, and which cells they go in
+        first = row_idx * self.cardinal
+        missing_places = [ first + c for c in mask_positions(self.row_blanks[row_idx]) ]
+        missing_row_numbers = self.missing_numbers(self.row_mask[row_idx])
         return self.guess(missing_row_numbers, missing_places, choose_max)
 
     def guess_col(self, col_idx, num_missing, choose_max):
-        # Find the missing numbers from that col, and what row, square they are in
-        missing_places = [ (r,c,s) for (r,c,s) in self.empty_cells if c == col_idx ]
-        missing_col_numbers = self.missing_numbers(self.col_nums[col_idx])
+        # Find the missing numbers from that col, and which cells they go in
+        missing_places = [ r * self.cardinal + col_idx
+                           for r in mask_positions(self.col_blanks[col_idx]) ]
+        missing_col_numbers = self.missing_numbers(self.col_mask[col_idx])
         return self.guess(missing_col_numbers, missing_places, choose_max)
 
     def guess_square(self, square_idx, num_missing, choose_max):
-        # Find the missing numbers from that square, and what row, col they are in
-        missing_places = [ (r,c,s) for (r,c,s) in self.empty_cells if s == square_idx ]
-        missing_square_numbers = self.missing_numbers(self.square_nums[square_idx])
+        # Find the missing numbers from that square, and which cells they go in
+        root = self.cardinal_root
+        first = ((square_idx // root) * self.cardinal + square_idx % root) * root
+        missing_places = [ first + (pos // root) * self.cardinal + pos % root
+                           for pos in mask_positions(self.square_blanks[square_idx]) ]
+        missing_square_numbers = self.missing_numbers(self.square_mask[square_idx])
         return self.guess(missing_square_numbers, missing_places, choose_max)
 
     def guess(self, missing_numbers, missing_places, choose_max):
-        for (r,c,s) in missing_places:
-            if self.verbose:
-                print("(%d,%d) in square %d" % (r,c,s))
-            # Can we eliminate any choices because already in col?
-            possibles = []
-            for n in missing_numbers:
-                if self.verbose:
-                    print("  trying %d... " % n),
-                if n in self.row_nums[r]:
-                    if self.verbose:
-                        print("already in row %d" % r)
-                    continue
-                if n in self.col_nums[c]:
-                    if self.verbose:
-                        print("already in column %d" % c)
-                    continue
-                if n in self.square_nums[s]:
-                    if self.verbose:
-                        print("already in square %d" % s)
-                    continue
-                if self.verbose:
-                    print("possible")
-                possibles.append(n)
-            if len(possibles) == 0:
+        """ Look for a move in the given cells, which are numbered
+        r * cardinal + c """
+        for idx in missing_places:
+            (r, c) = (self.cell_row[idx], self.cell_col[idx])
+            # The candidate mask has already eliminated anything
+            # in the same row, column or square
+            possibles = self.candidates[idx] & missing_numbers
+            if possibles == 0:
                 continue
-            if len(possibles) == 1:
+            if possibles & (possibles - 1) == 0:
                 # We can put N in the cell at row r, col c
-                return (r,c, possibles[0])
-            if choose_max > 1 and len(possibles) <= choose_max:
+                return (r, c, possibles.bit_length())
+            if choose_max > 1 and possibles.bit_count() <= choose_max:
                 # We're desperate, choose first one, mark others for backtrack
+                possibles = mask_numbers(possibles)
                 self.search_backtracks.append(
-                    (self.state_copy(), [ (r,c,p) for p in possibles[1:] ])
+                    (len(self.trail), [ (r,c,p) for p in possibles[1:] ])
                     )
                 return (r,c, possibles[0])
         return None
@@ -314,21 +771,22 @@ class Sudoku:
                     l[i] = "."
         self.compute_groups()
 
-def fullGrid(verbose):
+def fullGrid(verbose, cardinal_root=3):
     """ Return a sudoku grid which is filled
     randomly.
     """
-    base_grid = """
-123456789
-456789123
-789123456
-234567891
-567891234
-891234567
-345678912
-678912345
-912345678
-"""
+    # Each row is the one above shifted along by a square, or by one
+    # more at the start of each band. For 3 x 3 squares:
+    # 123456789
+    # 456789123
+    # 789123456
+    # 234567891
+    # ...
+    cardinal = cardinal_root * cardinal_root
+    base_grid = [ [ cell_alphabet[(cardinal_root * (r % cardinal_root) +
+                                   r // cardinal_root + c) % cardinal]
+                    for c in range(0, cardinal) ]
+                  for r in range(0, cardinal) ]
     s = Sudoku(base_grid, verbose=verbose)
     assert s.is_finished()
     assert s.is_valid()
@@ -362,12 +820,20 @@ if __name__ == "__main__":
     assert s.is_valid()
     """
 
+    # Optionally pick the solve strategy and square size on the
+    # command line
+    strategy = "heuristic"
+    if len(sys.argv) > 1:
+        strategy = sys.argv[1]
+    cardinal_root = 3
+    if len(sys.argv) > 2:
+        cardinal_root = int(sys.argv[2])
     total_moves = 0
     instances = 10
     tolerance = 50000
     solved = 0
     for i in range(0, instances):
-        s2 = fullGrid(verbose=False)
+        s2 = fullGrid(verbose=False, cardinal_root=cardinal_root)
         s2.scramble(degree=25)
         assert s2.is_valid()
 
@@ -382,7 +848,7 @@ if __name__ == "__main__":
         finished = False
         tried_moves = 0
         backtracks = 0
-        s2.start_solving()
+        s2.start_solving(strategy=strategy)
         while not finished:
             if tried_moves > tolerance:
                 print("Giving up after %d moves" % tried_moves)
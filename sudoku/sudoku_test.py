@@ -1,7 +1,22 @@
 #!/usr/bin/python3
 
+import asyncio
+import concurrent.futures
+import os
+import random
+import tempfile
 import unittest
+import numpy as np
+
+import batch
+import canonical
+import generator
+import packed
+import parallel
+import server
+import solve_file
 import sudoku
+import symmetry
 
 class TestBoard(unittest.TestCase):
     def setUp(self):
@@ -32,5 +47,434 @@ class TestBoard(unittest.TestCase):
         self.assertFalse(self.b.is_finished())
         self.assertTrue(self.b.is_valid())
 
+    def test_incremental_groups(self):
+        # Placing and removing numbers must leave the masks exactly
+        # as a full rebuild would
+        fresh = sudoku.Sudoku(self.board1s)
+        self.b.add_number(0, 0, 1)
+        self.assertEqual(self.b.lines[0][0], '1')
+        self.assertEqual(self.b.candidates[1] & 1, 0)
+        self.b.remove_number(0, 0)
+        self.assertEqual(self.b.lines, fresh.lines)
+        for attr in ['row_mask', 'col_mask', 'square_mask', 'candidates',
+                     'row_blanks', 'col_blanks', 'square_blanks',
+                     'row_missing', 'col_missing', 'square_missing',
+                     'empty_count']:
+            self.assertEqual(getattr(self.b, attr), getattr(fresh, attr))
+
+    def test_backtrack_undo(self):
+        # Backtracking unwinds every move made since the choice point
+        fresh = sudoku.Sudoku(self.board1s)
+        self.b.start_solving()
+        self.b.search_backtracks.append((len(self.b.trail), [(0, 0, 1)]))
+        for i in range(0, 5):
+            self.b.solve()
+        self.assertEqual(len(self.b.trail), 5)
+        self.b.backtrack()
+        self.assertEqual(self.b.trail, [])
+        self.assertEqual(self.b.next_guess, (0, 0, 1))
+        self.assertFalse(self.b.has_backtracks())
+        self.assertEqual(self.b.lines, fresh.lines)
+        self.assertEqual(self.b.candidates, fresh.candidates)
+
+    def solve_all(self, s, strategy, tolerance=50000):
+        s.start_solving(strategy=strategy)
+        moves = 0
+        finished = False
+        while not finished and moves < tolerance:
+            moves += 1
+            try:
+                finished = s.solve()
+            except sudoku.UnsolvableGridError:
+                if not s.has_backtracks():
+                    break
+                s.backtrack()
+        return finished
+
+    def test_propagate(self):
+        self.assertTrue(self.solve_all(self.b, "propagate"))
+        self.assertTrue(self.b.is_valid())
+        # Only the blanks were filled in
+        for (l, o) in zip(self.b.lines, sudoku.gridStringToLines(self.board1s)):
+            for (n, m) in zip(l, o):
+                self.assertTrue(m == '.' or n == m)
+        # One of the hardest known puzzles is beyond the heuristic
+        hard = sudoku.Sudoku("""
+8........
+..36.....
+.7..9.2..
+.5...7...
+....457..
+...1...3.
+..1....68
+..85...1.
+.9....4..
+""")
+        self.assertTrue(self.solve_all(hard, "propagate"))
+        self.assertEqual(hard.lines[0], list("812753649"))
+        self.assertRaises(ValueError, hard.start_solving, "bogus")
+
+    def test_solution_backends(self):
+        expected = self.b.solution(backend="propagate")
+        self.assertEqual(self.b.solution(backend="dlx"), expected)
+        self.assertEqual(self.b.solution(backend="heuristic"), expected)
+        # The grid itself is left alone
+        self.assertEqual(self.b.lines, sudoku.gridStringToLines(self.board1s))
+        # No duplicates, but nowhere left to put a 9 in the first row
+        stuck = sudoku.Sudoku("12345678.\n........9" + "\n........." * 7)
+        for backend in sudoku.solve_backends:
+            self.assertRaises(sudoku.UnsolvableGridError, stuck.solution,
+                              backend=backend)
+        self.assertRaises(ValueError, stuck.solution, backend="bogus")
+
+    def test_bigger_grids(self):
+        for root in [2, 4, 5]:
+            full = sudoku.fullGrid(verbose=False, cardinal_root=root)
+            self.assertEqual(full.cardinal, root * root)
+            self.assertTrue(full.is_finished())
+            self.assertTrue(full.is_valid())
+        # A 16 x 16 grid written out with 1-9 and A-G
+        full = sudoku.fullGrid(verbose=False, cardinal_root=4)
+        full.scramble(degree=50)
+        full.lines[0][0] = '.'
+        full.lines[15][15] = '.'
+        grid = "\n".join([ "".join(l) for l in full.lines ])
+        s = sudoku.Sudoku(grid)
+        self.assertEqual(s.cardinal_root, 4)
+        self.assertEqual(s.empty_count, 2)
+        solved = sudoku.Sudoku(s.solution(backend="propagate"))
+        self.assertTrue(solved.is_finished())
+        self.assertTrue(solved.is_valid())
+        self.assertRaises(IOError, sudoku.gridStringToLines, "12345678G")
+        self.assertRaises(IOError, sudoku.Sudoku, "123\n231\n312")
+
+    def test_batch(self):
+        good = batch.lines_to_array(self.b.lines)
+        bad = good.copy()
+        bad[0][0] = 2
+        stuck = batch.lines_to_array(
+            sudoku.gridStringToLines("12345678.\n........9" + "\n........." * 7))
+        grids = np.array([good, bad, stuck, good])
+        self.assertEqual(list(batch.validate(grids)), [True, False, True, True])
+        (done, status) = batch.propagate(grids)
+        self.assertEqual(list(status), [batch.SOLVED, batch.INVALID,
+                                        batch.INVALID, batch.SOLVED])
+        expected = self.b.solution()
+        self.assertEqual(batch.array_to_lines(done[0]), expected)
+        # The input batch is left alone
+        self.assertEqual(grids[0][0][0], 0)
+        # Grids that need a search get one
+        hard = sudoku.Sudoku("8" + "." * 8 + "\n..36.....\n.7..9.2..\n.5...7...\n"
+                             "....457..\n...1...3.\n..1....68\n..85...1.\n.9....4..")
+        grids = np.array([batch.lines_to_array(hard.lines), good])
+        (done, solved) = batch.solve(grids)
+        self.assertEqual(list(solved), [True, True])
+        self.assertEqual(batch.array_to_lines(done[0]), hard.solution())
+        self.assertEqual(batch.array_to_lines(done[1]), expected)
+
+    def test_stats(self):
+        hard = sudoku.Sudoku("8" + "." * 8 + "\n..36.....\n.7..9.2..\n.5...7...\n"
+                             "....457..\n...1...3.\n..1....68\n..85...1.\n.9....4..")
+        stats = sudoku.SolverStats()
+        hard.solution(stats=stats)
+        self.assertEqual(stats.moves, stats.propagations + stats.guesses)
+        self.assertGreater(stats.guesses, 0)
+        self.assertGreater(stats.backtracks, 0)
+        self.assertGreater(stats.max_depth, 0)
+        self.assertGreater(stats.times["propagate"], 0)
+        self.assertIn("backtracks=%d" % stats.backtracks, str(stats))
+        stats = sudoku.SolverStats()
+        self.b.solution(backend="heuristic", stats=stats)
+        self.assertEqual(stats.moves, self.b.empty_count)
+        stats = sudoku.SolverStats()
+        hard.solution(backend="dlx", stats=stats)
+        self.assertGreater(stats.nodes, 0)
+        # Hooks see every move and backtrack
+        events = []
+        s = sudoku.Sudoku(hard.lines)
+        s.instrument(on_place=lambda s, r, c, n: events.append(("place", r, c, n)),
+                     on_guess=lambda s, r, c, n: events.append(("guess", r, c, n)),
+                     on_backtrack=lambda s: events.append(("backtrack",)))
+        s.start_solving(strategy="propagate")
+        (r, c, n) = s.propagate()
+        s.undo_to(0)
+        s.search_backtracks = []
+        s.next_guess = (r, c, n)
+        s.solve()
+        self.assertEqual(events, [ ("place", r, c, n), ("guess", r, c, n) ])
+        s.search_backtracks = [ (0, [ (r, c, n) ]) ]
+        s.backtrack()
+        self.assertEqual(events[-1], ("backtrack",))
+        self.assertEqual(s.empty_count, hard.empty_count)
+        # Taking the hooks off again
+        s.instrument()
+        self.assertNotIn("solve", s.__dict__)
+        s.solve()
+        self.assertEqual(len(events), 3)
+
+    def test_count_solutions(self):
+        self.assertEqual(self.b.count_solutions(), 1)
+        self.assertEqual(self.b.lines, sudoku.gridStringToLines(self.board1s))
+        # Without four of the clues in the first row there are two
+        for c in [2, 4, 6, 7]:
+            self.b.remove_number(0, c)
+        self.assertEqual(self.b.count_solutions(), 2)
+        self.assertEqual(self.b.count_solutions(limit=1), 1)
+        self.assertEqual(self.b.empty_count, 49)
+        # An empty grid has plenty
+        empty = sudoku.Sudoku(".........\n" * 9)
+        self.assertEqual(empty.count_solutions(limit=100), 100)
+        self.assertTrue(empty.is_valid())
+        self.assertEqual(empty.empty_count, 81)
+        stuck = sudoku.Sudoku("12345678.\n........9" + "\n........." * 7)
+        self.assertEqual(stuck.count_solutions(), 0)
+
+    def test_parallel(self):
+        hard = sudoku.Sudoku("8" + "." * 8 + "\n..36.....\n.7..9.2..\n.5...7...\n"
+                             "....457..\n...1...3.\n..1....68\n..85...1.\n.9....4..")
+        (grids, solutions) = parallel.split(hard.lines, 8)
+        self.assertGreaterEqual(len(grids), 8)
+        self.assertEqual(sum([ sudoku.Sudoku(g).count_solutions() for g in grids ]) +
+                         len(solutions), 1)
+        self.assertEqual(parallel.solution(hard.lines, workers=2), hard.solution())
+        for c in [2, 4, 6, 7]:
+            self.b.remove_number(0, c)
+        self.assertEqual(parallel.count_solutions(self.b.lines, workers=2, pieces=4), 2)
+        self.assertEqual(parallel.count_solutions(self.b.lines, limit=1, workers=2), 1)
+        stuck = sudoku.gridStringToLines("12345678.\n........9" + "\n........." * 7)
+        self.assertEqual(parallel.count_solutions(stuck, workers=2), 0)
+        self.assertRaises(sudoku.UnsolvableGridError, parallel.solution, stuck, workers=2)
+        # Invalid grids have no solutions, as with Sudoku.count_solutions
+        bad = sudoku.gridStringToLines("22" + "." * 79)
+        self.assertEqual(parallel.count_solutions(bad, workers=2), 0)
+        self.assertRaises(sudoku.InvalidGridError, parallel.solution, bad, workers=2)
+
+    def test_symmetry(self):
+        rng = random.Random(7)
+        for root in [2, 3, 4]:
+            full = sudoku.fullGrid(verbose=False, cardinal_root=root)
+            for i in range(0, 10):
+                transform = symmetry.random_transform(root, rng)
+                moved = symmetry.apply_transform(full.lines, transform)
+                self.assertTrue(sudoku.Sudoku(moved).is_valid())
+                back = symmetry.apply_transform(moved, symmetry.invert_transform(transform))
+                self.assertEqual(back, full.lines)
+        # Blanks stay blank
+        moved = symmetry.apply_transform(self.b.lines, symmetry.random_transform(3, rng))
+        self.assertEqual(sum([ l.count('.') for l in moved ]), self.b.empty_count)
+
+    def test_generator(self):
+        rng = random.Random(11)
+        (puzzle, solution) = generator.generate_puzzle(clues=30, rng=rng)
+        self.assertTrue(sum([ 9 - l.count('.') for l in puzzle ]) <= 30)
+        self.assertEqual(generator.solution_count(puzzle), 1)
+        self.assertEqual(sudoku.Sudoku(puzzle).solution(backend="dlx"), solution)
+        # Impossible targets give up
+        self.assertEqual(generator.generate_puzzle(clues=10, attempts=1, rng=rng), None)
+        self.assertEqual(generator.difficulty(self.b.lines), 0)
+        stuck = sudoku.gridStringToLines("12345678.\n........9" + "\n........." * 7)
+        self.assertRaises(sudoku.UnsolvableGridError, generator.difficulty, stuck)
+        # The same seed gives the same puzzles in the same order
+        one = list(generator.generate_stream(4, workers=1, seed=5, clues=40))
+        two = list(generator.generate_stream(4, workers=2, seed=5, clues=40))
+        self.assertEqual(one, two)
+        # Impossible targets stop the stream rather than spinning forever
+        self.assertEqual(list(generator.generate_stream(3, workers=1, seed=5, clues=10,
+                                                        attempts=1, max_failures=5)), [])
+
+    def test_canonical_form(self):
+        rng = random.Random(3)
+        (key, transform) = canonical.canonical_form(self.b.lines)
+        self.assertEqual(sudoku.linesToGridString(
+            symmetry.apply_transform(self.b.lines, transform)), key)
+        for i in range(0, 5):
+            moved = symmetry.apply_transform(self.b.lines,
+                                             symmetry.random_transform(3, rng))
+            self.assertEqual(canonical.canonical_form(moved)[0], key)
+
+    def test_solution_cache(self):
+        rng = random.Random(4)
+        expected = self.b.solution()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "solutions")
+            cache = canonical.SolutionCache(maxsize=1, path=path)
+            self.assertEqual(cache.solution(self.b.lines), expected)
+            transform = symmetry.random_transform(3, rng)
+            moved = symmetry.apply_transform(self.b.lines, transform)
+            self.assertEqual(cache.solution(moved),
+                             symmetry.apply_transform(expected, transform))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            stuck = "12345678.\n........9" + "\n........." * 7
+            for i in range(0, 2):
+                self.assertRaises(sudoku.UnsolvableGridError, cache.solution,
+                                  sudoku.gridStringToLines(stuck))
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            # A number twice in a row is no grid at all
+            repeated = sudoku.gridStringToLines("1.1......" + "\n........." * 8)
+            self.assertRaises(sudoku.InvalidGridError, canonical.canonical_form, repeated)
+            self.assertRaises(sudoku.InvalidGridError, cache.solution, repeated)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            cache.close()
+            # A new cache finds the solutions on disk
+            cache = canonical.SolutionCache(path=path)
+            self.assertEqual(cache.solution(self.b.lines), expected)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            cache.close()
+
+    def test_solve_file(self):
+        puzzle = sudoku.linesToGridString(self.b.lines)
+        solution = sudoku.linesToGridString(self.b.solution())
+        stuck = "12345678." + "........9" + "." * 63
+        lines = [ puzzle + "\n", "\n", "oops\n", stuck + "\n" ] * 3
+        expected = [ (1, solution), (3, "invalid"), (4, "unsolvable") ]
+        expected += [ (n + 4, r) for (n, r) in expected ] + \
+                    [ (n + 8, r) for (n, r) in expected ]
+        results = solve_file.solve_stream(iter(lines), workers=1, chunk_size=2,
+                                          in_flight=2)
+        self.assertEqual(list(results), expected)
+        results = solve_file.solve_stream(iter(lines), workers=2, chunk_size=1,
+                                          ordered=False)
+        self.assertEqual(sorted(results), expected)
+        self.assertTrue(solve_file.solve_line(puzzle, stats=True).startswith(
+            solution + " moves="))
+        # This one takes the propagate search millions of moves
+        fiendish = ".....6....59.....82....8....45........3........6..3.54...325..6" + "." * 18
+        self.assertEqual(solve_file.solve_line(fiendish, timeout=0.05), "timeout")
+
+    def test_server(self):
+        puzzle = sudoku.linesToGridString(self.b.lines)
+        solution = sudoku.linesToGridString(self.b.solution())
+        fiendish = ".....6....59.....82....8....45........3........6..3.54...325..6" + "." * 18
+
+        async def session(path):
+            service = server.SolveService(workers=1, max_pending=1, pipeline=2)
+            listener = asyncio.ensure_future(server.serve(service, path=path))
+            try:
+                for i in range(0, 100):
+                    if os.path.exists(path):
+                        break
+                    await asyncio.sleep(0.01)
+                (reader, writer) = await asyncio.open_unix_connection(path)
+                requests = [ puzzle, puzzle, "oops", fiendish + " 0.1", puzzle + " x",
+                         puzzle + " nan", puzzle + " inf", puzzle + " -1" ]
+                writer.write("".join([ r + "\n" for r in requests ]).encode("ascii"))
+                writer.write_eof()
+                answers = (await reader.read()).decode("ascii").split("\n")
+                writer.close()
+                return (answers, service.requests, service.coalesced)
+            finally:
+                listener.cancel()
+                service.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            (answers, requests, coalesced) = asyncio.run(
+                session(os.path.join(tmp, "socket")))
+        self.assertEqual(answers, [ solution, solution, "invalid", "timeout",
+                                    "invalid", "error", "error", "error", "" ])
+        self.assertEqual(requests, 4)
+        self.assertEqual(coalesced, 1)
+
+    def test_server_deadlines(self):
+        hard = "8" + "." * 8 + "..36......7..9.2...5...7.......457.....1...3...1....68..85...1..9....4.."
+        solution = solve_file.solve_line(hard)
+
+        async def solve_both(first, second):
+            service = server.SolveService(workers=1)
+            try:
+                # Warm up the pool so its start doesn't count
+                await service.solve(sudoku.linesToGridString(self.b.lines))
+                return await asyncio.gather(service.solve(hard, first),
+                                            service.solve(hard, second)) + \
+                       [ service.coalesced ]
+            finally:
+                service.close()
+
+        # A short limit mustn't cut short a longer one on the same puzzle
+        self.assertEqual(asyncio.run(solve_both(0.0001, None)), [ "timeout", solution, 0 ])
+        self.assertEqual(asyncio.run(solve_both(0.0001, 10)), [ "timeout", solution, 0 ])
+        # but a longer one can be shared
+        self.assertEqual(asyncio.run(solve_both(None, 0.0001)), [ solution, "timeout", 1 ])
+        self.assertEqual(asyncio.run(solve_both(10, 5)), [ solution, solution, 1 ])
+
+        async def failing(path):
+            service = server.SolveService(workers=1, pipeline=1)
+
+            async def broken(line, timeout=None):
+                raise concurrent.futures.process.BrokenProcessPool("gone")
+
+            service.solve = broken
+            listener = asyncio.ensure_future(server.serve(service, path=path))
+            try:
+                for i in range(0, 100):
+                    if os.path.exists(path):
+                        break
+                    await asyncio.sleep(0.01)
+                (reader, writer) = await asyncio.open_unix_connection(path)
+                writer.write(((hard + "\n") * 3).encode("ascii"))
+                writer.write_eof()
+                answers = (await asyncio.wait_for(reader.read(), 10)).decode("ascii")
+                writer.close()
+                return answers.split("\n")
+            finally:
+                listener.cancel()
+                service.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(asyncio.run(failing(os.path.join(tmp, "socket"))),
+                             [ "error", "error", "error", "" ])
+
+    def test_packed(self):
+        puzzle = sudoku.linesToGridString(self.b.lines)
+        solution = sudoku.linesToGridString(self.b.solution())
+        small = sudoku.linesToGridString(sudoku.fullGrid(False, cardinal_root=2).lines)
+        self.assertEqual(packed.record_size(9), 41)
+        self.assertEqual(packed.record_size(16), 256)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "grids.sdk")
+            self.assertEqual(packed.text_to_packed([ puzzle + "\n", "\n",
+                                                     solution + "\n" ], path), 2)
+            self.assertEqual(os.path.getsize(path), packed.header.size + 2 * 41)
+            with packed.Reader(path) as reader:
+                self.assertEqual(len(reader), 2)
+                self.assertEqual(reader[0].lines, self.b.lines)
+                self.assertEqual([ sudoku.linesToGridString(s.lines) for s in reader ],
+                                 [ puzzle, solution ])
+                self.assertEqual(len(reader.raw(1)), 41)
+                self.assertFalse(reader.raw(1).flags.writeable)
+                grids = reader.arrays()
+                self.assertEqual(grids.shape, (2, 9, 9))
+                self.assertTrue((reader.array(-1) == grids[1]).all())
+                (solved, ok) = batch.solve(grids)
+                self.assertTrue(ok.all())
+                self.assertTrue((solved[0] == grids[1]).all())
+            with packed.Writer(path, cardinal=4) as writer:
+                writer.write(sudoku.gridStringToLines(small))
+                self.assertRaises(ValueError, writer.write_arrays, grids)
+            with packed.Reader(path) as reader:
+                self.assertEqual(reader.cardinal, 4)
+                self.assertEqual(sudoku.linesToGridString(reader.lines(0)), small)
+            # Views can outlive the reader
+            with packed.Reader(path) as reader:
+                record = reader.raw(0)
+            self.assertEqual(len(record), packed.record_size(4))
+            del record
+            # Bad lines, first or later
+            self.assertRaises(IOError, packed.text_to_packed, [ "12345\n" ], path)
+            self.assertRaises(IOError, packed.text_to_packed, [ puzzle + "\n", "123\n" ], path)
+            with packed.Reader(path) as reader:
+                self.assertEqual(len(reader), 0)
+            with open(path, "wb") as f:
+                f.write(b"123456789" * 9)
+            self.assertRaises(IOError, packed.Reader, path)
+
+    def test_invalid(self):
+        # A second 2 in the first row
+        self.b.add_number(0, 0, 2)
+        self.assertFalse(self.b.is_valid())
+        self.b.remove_number(0, 0)
+        self.assertTrue(self.b.is_valid())
+        bad = self.board1s.replace("..2.3.546", "2.2.3.546")
+        self.assertRaises(sudoku.InvalidGridError, sudoku.Sudoku, bad)
+
 if __name__ == "__main__":
     unittest.main()
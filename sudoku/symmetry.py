@@ -0,0 +1,67 @@
+"""
+The symmetries of a sudoku grid: permuting bands, rows within a band,
+stacks, columns within a stack, transposing and relabelling the
+numbers all turn a valid grid into another valid grid.
+
+A transform is a tuple (transpose, rows, cols, numbers). The grid is
+transposed first if transpose is true; then row i of the result is
+row rows[i] of that, column j is column cols[j], and number n becomes
+numbers[n-1].
+"""
+
+import random
+
+import sudoku
+
+def identity_transform(cardinal_root):
+    cardinal = cardinal_root * cardinal_root
+    order = list(range(0, cardinal))
+    return (False, order, order[:], [ n + 1 for n in order ])
+
+def random_line_order(cardinal_root, rng):
+    """ A random order of rows or columns that keeps bands or stacks
+    together """
+    blocks = list(range(0, cardinal_root))
+    rng.shuffle(blocks)
+    order = []
+    for b in blocks:
+        within = list(range(0, cardinal_root))
+        rng.shuffle(within)
+        order.extend([ b * cardinal_root + i for i in within ])
+    return order
+
+def random_transform(cardinal_root, rng=random):
+    """ A transform drawn uniformly from the whole symmetry group """
+    numbers = list(range(1, 1 + cardinal_root * cardinal_root))
+    rng.shuffle(numbers)
+    return (rng.random() < 0.5,
+            random_line_order(cardinal_root, rng),
+            random_line_order(cardinal_root, rng),
+            numbers)
+
+def apply_transform(lines, transform):
+    """ New lines for a grid after a transform """
+    (transpose, rows, cols, numbers) = transform
+    if transpose:
+        lines = [ list(l) for l in zip(*lines) ]
+    relabel = dict((sudoku.cell_alphabet[n], sudoku.cell_alphabet[numbers[n]-1])
+                   for n in range(0, len(numbers)))
+    return [ [ relabel.get(lines[r][c], lines[r][c]) for c in cols ] for r in rows ]
+
+def invert_order(order):
+    inverse = [ 0 for i in order ]
+    for (i, o) in enumerate(order):
+        inverse[o] = i
+    return inverse
+
+def invert_transform(transform):
+    """ The transform that undoes this one """
+    (transpose, rows, cols, numbers) = transform
+    unnumbers = [ 0 for n in numbers ]
+    for (n, m) in enumerate(numbers):
+        unnumbers[m-1] = n + 1
+    if transpose:
+        # Undo the permutations first and then transpose, which is
+        # the same as transposing first with rows and columns swapped
+        return (True, invert_order(cols), invert_order(rows), unnumbers)
+    return (False, invert_order(rows), invert_order(cols), unnumbers)
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+"""
+Play a great many games of victimhood to see how the cards and seats
+fare, for balancing the card scores.
+
+Each game deals every player their cards and then the community cards
+from a shuffled deck of deck_multiple copies of the cards, and whoever
+has the best hand with the community cards wins, or ties if others
+score the same. Games are played in batches: a batch of decks is one
+array of card ids, shuffled a row per game, and each player's cards
+are a slice of it, scored with vectorized.py.
+
+The games are split into shards of a fixed size, played in a pool of
+worker processes, each from its own seed derived from the tournament's
+seed and the shard's number. Shards only report integer totals, so the
+results are the same however many workers there are.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+
+import victimhood
+import vectorized
+
+class ArrayDeck:
+ """ Decks of card ids for a batch of games at a time. The array is
+ kept and shuffled again for each batch. """
+
+ def __init__(self, deck_multiple, games):
+   cards = np.repeat(np.arange(len(victimhood.card_names), dtype=np.uint8), deck_multiple)
+   self.decks = np.tile(cards, (games, 1))
+
+ def shuffle(self, rng, games=None):
+   """ games freshly shuffled decks, as rows """
+   decks = self.decks[:games]
+   rng.permuted(decks, axis=1, out=decks)
+   return decks
+
+class Totals:
+ """ Counts over a number of games: wins and ties by seat, and for
+ each card, how many hands it was dealt to and how many of those won
+ or tied """
+
+ def __init__(self, players):
+   self.games = 0
+   self.seat_wins = np.zeros(players, dtype=np.int64)
+   self.seat_ties = np.zeros(players, dtype=np.int64)
+   self.card_hands = np.zeros(len(victimhood.card_names), dtype=np.int64)
+   self.card_wins = np.zeros(len(victimhood.card_names), dtype=np.int64)
+   self.card_ties = np.zeros(len(victimhood.card_names), dtype=np.int64)
+
+ def add(self, other):
+   self.games += other.games
+   for name in ("seat_wins", "seat_ties", "card_hands", "card_wins", "card_ties"):
+     getattr(self, name)[:] += getattr(other, name)
+
+def check_config(players, cards, community, deck_multiple):
+ needed = players * cards + community
+ if needed > len(victimhood.card_names) * deck_multiple:
+   raise ValueError("Can't deal %d cards from %d decks" % (needed, deck_multiple))
+
+def play(totals, decks, players, cards, community):
+ """ Play a batch of games from an array of decks, adding to totals """
+ bits = vectorized.card_bits[decks[:, :players * cards + community]]
+ shared = np.bitwise_or.reduce(bits[:, players * cards:], axis=1)
+ own = np.bitwise_or.reduce(bits[:, :players * cards].reshape((len(decks), players, cards)),
+                            axis=2)
+ scores = vectorized.score_masks(own | shared[:, None])
+ top = scores == scores.max(axis=1, keepdims=True)
+ alone = top.sum(axis=1, keepdims=True) == 1
+ wins = top & alone
+ ties = top & ~alone
+ totals.games += len(decks)
+ totals.seat_wins += wins.sum(axis=0)
+ totals.seat_ties += ties.sum(axis=0)
+ # Which cards each hand holds, (games x players x cards)
+ held = ((own[:, :, None] >> np.arange(len(victimhood.card_names))) & 1).astype(bool)
+ totals.card_hands += held.sum(axis=(0, 1))
+ totals.card_wins += (held & wins[:, :, None]).sum(axis=(0, 1))
+ totals.card_ties += (held & ties[:, :, None]).sum(axis=(0, 1))
+
+def shard_seed(seed, shard):
+ return np.random.SeedSequence(entropy=seed, spawn_key=(shard,))
+
+def run_shard(games, players, cards, community, deck_multiple, seed, shard,
+              chunk_size=50000):
+ """ Play one shard of games in a worker, returning its Totals """
+ rng = np.random.default_rng(shard_seed(seed, shard))
+ totals = Totals(players)
+ deck = ArrayDeck(deck_multiple, min(chunk_size, games))
+ for start in range(0, games, chunk_size):
+   decks = deck.shuffle(rng, min(chunk_size, games - start))
+   play(totals, decks, players, cards, community)
+ return totals
+
+def run_tournament(games, players=4, cards=5, community=3, deck_multiple=2, seed=0,
+                   workers=None, shard_size=1000000):
+ """ Totals for games games, played on a pool of worker processes """
+ check_config(players, cards, community, deck_multiple)
+ if workers is None:
+   workers = os.cpu_count() or 1
+ totals = Totals(players)
+ with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+   shards = [ pool.submit(run_shard, min(shard_size, games - start), players, cards,
+                          community, deck_multiple, seed, shard)
+              for (shard, start) in enumerate(range(0, games, shard_size)) ]
+   for future in concurrent.futures.as_completed(shards):
+     totals.add(future.result())
+ return totals
+
+def report(totals, out=sys.stdout):
+ out.write("%d games\n\n" % totals.games)
+ games = max(1, totals.games)
+ for p in range(0, len(totals.seat_wins)):
+   out.write("Seat %d: wins %.4f, ties %.4f\n" %
+             (p + 1, totals.seat_wins[p] / games, totals.seat_ties[p] / games))
+ out.write("\n%-16s %5s %10s %8s %8s\n" % ("Card", "Score", "Hands", "Wins", "Ties"))
+ for i in sorted(range(0, len(victimhood.card_names)),
+                 key=lambda i: (-victimhood.card_scores[i], victimhood.card_names[i])):
+   hands = max(1, totals.card_hands[i])
+   out.write("%-16s %5d %10d %8.4f %8.4f\n" %
+             (victimhood.card_names[i], victimhood.card_scores[i], totals.card_hands[i],
+              totals.card_wins[i] / hands, totals.card_ties[i] / hands))
+
+if __name__ == "__main__":
+ parser = argparse.ArgumentParser(description=
+   "Play many games of victimhood and report win rates by seat and card")
+ parser.add_argument("--games", type=int, default=1000000)
+ parser.add_argument("--players", type=int, default=4)
+ parser.add_argument("--cards", type=int, default=5, help="cards dealt to each player")
+ parser.add_argument("--community", type=int, default=3, help="community cards")
+ parser.add_argument("--deck-multiple", type=int, default=2)
+ parser.add_argument("--seed", type=int, default=0)
+ parser.add_argument("--workers", type=int, help="worker processes")
+ parser.add_argument("--shard-size", type=int, default=1000000,
+                     help="games per job sent to a worker")
+ args = parser.parse_args()
+ try:
+   check_config(args.players, args.cards, args.community, args.deck_multiple)
+ except ValueError as e:
+   parser.error(str(e))
+ start = time.time()
+ totals = run_tournament(args.games, args.players, args.cards, args.community,
+                         args.deck_multiple, args.seed, args.workers, args.shard_size)
+ report(totals)
+ sys.stderr.write("Took %.2fs\n" % (time.time() - start))
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+"""
+Chances of winning from part way through a game of victimhood.
+
+Hands are masks of card ids, as in victimhood.Hand, held in NumPy
+arrays so that a whole batch of them is scored at once from the best
+hand table. The cards still to come are dealt from what's left of the
+game's deck, either every possible way when there are few enough, or
+at random many times over.
+
+A player wins a deal by scoring more than everyone else, and ties if
+they share the top score with anyone.
+"""
+
+import argparse
+import itertools
+import math
+import random
+import time
+
+import numpy as np
+
+import victimhood
+
+# Best hand score for each key of the table
+key_scores = np.frombuffer(victimhood.best_table, dtype=np.uint8,
+                           offset=victimhood.table_header.size,
+                           count=victimhood.table_entries * victimhood.entry_size
+                           )[::victimhood.entry_size].copy()
+class_digits = [ np.array(digits, dtype=np.int32) for digits in victimhood.class_digits ]
+card_bits = np.array([ 1 << i for i in range(0, len(victimhood.card_names)) ], dtype=np.int32)
+
+def score_masks(masks):
+ """ Best hand scores of an array of hand masks """
+ masks = np.asarray(masks, dtype=np.int32)
+ key = np.zeros(masks.shape, dtype=np.int32)
+ for c in range(0, len(class_digits)):
+   key += class_digits[c][(masks >> victimhood.class_first[c]) & victimhood.class_fields[c]]
+ return key_scores[key]
+
+def mask_of(ids):
+ mask = 0
+ for i in ids:
+   mask |= 1 << i
+ return mask
+
+def deal_count(remaining, groups):
+ """ How many ways there are to deal cards in groups of these sizes
+ from remaining cards """
+ total = 1
+ for g in groups:
+   total *= math.comb(remaining, g)
+   remaining -= g
+ return total
+
+def all_deals(remaining, groups):
+ """ Every way of dealing groups of these sizes from remaining cards,
+ as a (deals x cards) array of positions in the deck, each group's
+ positions in order """
+ deals = np.zeros((1, 0), dtype=np.intp)
+ for g in groups:
+   if g == 0:
+     continue
+   # Positions nobody in the deal has yet, in order
+   used = np.zeros((len(deals), remaining), dtype=bool)
+   np.put_along_axis(used, deals, True, axis=1)
+   unused = np.argsort(used, axis=1, kind="stable")[:, :remaining - deals.shape[1]]
+   choices = np.array(list(itertools.combinations(range(unused.shape[1]), g)), dtype=np.intp)
+   picked = unused[:, choices]
+   deals = np.concatenate([ np.repeat(deals[:, None, :], len(choices), axis=1), picked ],
+                          axis=2).reshape((-1, deals.shape[1] + g))
+ return deals
+
+def random_deals(remaining, cards, trials, rng):
+ """ trials random deals of cards from remaining cards, as positions
+ in the deck """
+ return np.argpartition(rng.random((trials, remaining)), cards - 1, axis=1)[:, :cards] \
+        if cards > 0 else np.zeros((trials, 0), dtype=np.intp)
+
+class Equity:
+ """ Chances of each player winning outright and of tying, over
+ completions deals of the cards to come """
+
+ def __init__(self, wins, ties, completions, exact):
+   self.win = wins / completions
+   self.tie = ties / completions
+   self.completions = completions
+   self.exact = exact
+
+def equity(player_ids, community_ids, deck_ids, community_to_come=0, cards_to_come=0,
+           trials=1000000, exact_limit=1000000, rng=None, chunk_size=100000):
+ """ The Equity of players holding the card ids in player_ids, with
+ community_ids on the table, when community_to_come more community
+ cards and then cards_to_come more cards each are dealt from deck_ids.
+ Every deal is tried if there are no more than exact_limit of them,
+ otherwise trials random ones. """
+ players = len(player_ids)
+ deck_ids = np.asarray(deck_ids, dtype=np.intp)
+ groups = [ community_to_come ] + [ cards_to_come ] * players
+ if sum(groups) > len(deck_ids):
+   raise ValueError("Only %d cards left to deal %d" % (len(deck_ids), sum(groups)))
+ known = np.array([ mask_of(ids) | mask_of(community_ids) for ids in player_ids ], dtype=np.int32)
+ exact = deal_count(len(deck_ids), groups) <= exact_limit
+ if exact:
+   deals = all_deals(len(deck_ids), groups)
+   batches = [ deals[start:start + chunk_size] for start in range(0, len(deals), chunk_size) ]
+ else:
+   if rng is None:
+     rng = np.random.default_rng()
+   batches = ( random_deals(len(deck_ids), sum(groups), min(chunk_size, trials - start), rng)
+               for start in range(0, trials, chunk_size) )
+ wins = np.zeros(players, dtype=np.int64)
+ ties = np.zeros(players, dtype=np.int64)
+ completions = 0
+ for positions in batches:
+   bits = card_bits[deck_ids[positions]]
+   community = np.bitwise_or.reduce(bits[:, :community_to_come], axis=1)
+   masks = np.empty((len(bits), players), dtype=np.int32)
+   for p in range(0, players):
+     start = community_to_come + p * cards_to_come
+     own = np.bitwise_or.reduce(bits[:, start:start + cards_to_come], axis=1)
+     masks[:, p] = known[p] | community | own
+   scores = score_masks(masks)
+   top = scores == scores.max(axis=1, keepdims=True)
+   alone = top.sum(axis=1, keepdims=True) == 1
+   wins += (top & alone).sum(axis=0)
+   ties += (top & ~alone).sum(axis=0)
+   completions += len(bits)
+ return Equity(wins, ties, completions, exact)
+
+def game_equity(game, community_cards=None, cards_per_player=None, **kwargs):
+ """ The Equity of each player of a victimhood.Game, in order, once
+ there are community_cards community cards and cards_per_player cards
+ in each hand, by default as many as there are now """
+ player_ids = [ list(game.player_hands[p].order)
+                for p in range(1, 1 + game.player_count) ]
+ community_ids = list(game.community.order)
+ if community_cards is None:
+   community_cards = len(community_ids)
+ dealt = min([ len(ids) for ids in player_ids ])
+ if cards_per_player is None:
+   cards_per_player = dealt
+ if any([ len(ids) != dealt for ids in player_ids ]):
+   raise ValueError("Players have different numbers of cards")
+ deck_ids = [ victimhood.card_id(card) for card in game.deck ]
+ return equity(player_ids, community_ids, deck_ids,
+               max(0, community_cards - len(community_ids)),
+               max(0, cards_per_player - dealt), **kwargs)
+
+if __name__ == "__main__":
+ parser = argparse.ArgumentParser(description=
+   "Deal a game of victimhood and work out everyone's chances")
+ parser.add_argument("--players", type=int, default=4)
+ parser.add_argument("--cards", type=int, default=5, help="cards dealt to each player")
+ parser.add_argument("--community", type=int, default=3, help="community cards to come")
+ parser.add_argument("--deck-multiple", type=int, default=2)
+ parser.add_argument("--trials", type=int, default=1000000)
+ parser.add_argument("--exact-limit", type=int, default=1000000)
+ parser.add_argument("--seed", type=int)
+ args = parser.parse_args()
+ random.seed(args.seed)
+ g = victimhood.Game(player_count=args.players, deck_multiple=args.deck_multiple)
+ g.deal(args.cards)
+ start = time.time()
+ e = game_equity(g, community_cards=args.community, trials=args.trials,
+                 exact_limit=args.exact_limit, rng=np.random.default_rng(args.seed))
+ for p in range(1, 1 + args.players):
+   print("Player %d with %s: wins %.4f, ties %.4f" %
+         (p, g.player_hands[p], e.win[p - 1], e.tie[p - 1]))
+ print("%s over %d deals in %.2fs" % ("Exact" if e.exact else "Sampled",
+                                      e.completions, time.time() - start))
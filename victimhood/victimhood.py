@@ -4,8 +4,16 @@
 Original post http://marlinschamps.blogspot.com/2006/08/tdl-gaming-world-series-of-victimhood.html
 """
 
+import array
+import collections
+import itertools
+import mmap
+import os
 import random
 import string
+import struct
+import tempfile
+import zlib
 
 deck = {
  # Key: (points,class)
@@ -38,101 +46,294 @@ category_list = [
  'economic','none','skin','religion','ethnicity','gender',
 ]
 categories = set(category_list)
+# The cards of one deck, in the order a Game's deck starts in
+deck_cards = list(deck.keys())
+
+# Cards as small integers: ids run through the classes in category_list
+# order, best card first within a class, so that the lowest bit of a
+# class in a hand's mask is a best scoring card of that class
+card_names = sorted(deck.keys(),
+                    key=lambda card: (category_list.index(deck[card][1]), -deck[card][0]))
+card_ids = dict((card, i) for (i, card) in enumerate(card_names))
+card_scores = array.array('b', [ deck[card][0] for card in card_names ])
+card_classes = array.array('b', [ category_list.index(deck[card][1]) for card in card_names ])
+# Mask of the card ids in each class, in category_list order
+class_masks = [ sum([ 1 << i for i in range(0, len(card_names)) if card_classes[i] == c ])
+                for c in range(0, len(category_list)) ]
+
+# A table of the best hand for every choice of best card in each class.
+# Its key counts in mixed radix, one digit per class: 0 if the hand
+# has no card of the class, otherwise 1 plus the position of its best
+# card in the class. Each entry is the score and the ids of the cards
+# of the best hand, in the order besthand() gives when there are no
+# ties, padded with no_card. The table lives in a file next to this
+# one, which is made the first time it's needed.
+table_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "besthand.table")
+table_header = struct.Struct("<4sIII")  # magic, deck checksum, entries, entry size
+table_magic = b"VHBT"
+entry_size = 6
+no_card = 255
+class_first = [ card_classes.tolist().index(c) for c in range(0, len(category_list)) ]
+class_sizes = [ card_classes.tolist().count(c) for c in range(0, len(category_list)) ]
+class_radix = [ 1 ]
+for size in class_sizes[:-1]:
+  class_radix.append(class_radix[-1] * (size + 1))
+table_entries = class_radix[-1] * (class_sizes[-1] + 1)
+# class_digits[c][m] is the digit of class c, times its radix, for a
+# hand whose mask has the bits m in that class
+class_digits = [ [ 0 ] + [ ((m & -m).bit_length()) * radix for m in range(1, 1 << size) ]
+                 for (size, radix) in zip(class_sizes, class_radix) ]
+class_fields = [ (1 << size) - 1 for size in class_sizes ]
+
+def deck_checksum():
+ """ Changes if the deck changes, so an old table isn't used """
+ return zlib.crc32(repr((card_names, card_scores.tolist(), card_classes.tolist())).encode("ascii"))
+
+def table_key(mask):
+ """ Where a hand with this mask of card ids is in the table """
+ key = 0
+ for c in range(0, len(class_sizes)):
+   key += class_digits[c][(mask >> class_first[c]) & class_fields[c]]
+ return key
+
+def build_table():
+ """ The bytes of a best hand table, header and all """
+ table = bytearray(table_header.pack(table_magic, deck_checksum(), table_entries, entry_size))
+ table.extend(bytes([ no_card ]) * (table_entries * entry_size))
+ choices = [ range(0, size + 1) for size in class_sizes ]
+ for digits in itertools.product(*choices):
+   ids = [ class_first[c] + d - 1 for (c, d) in enumerate(digits) if d > 0 ]
+   ids.sort(key=card_scores.__getitem__)
+   ids = ids[0:5]
+   offset = table_header.size + entry_size * sum([ d * r for (d, r) in zip(digits, class_radix) ])
+   table[offset] = sum([ card_scores[i] for i in ids ])
+   table[offset + 1:offset + 1 + len(ids)] = bytes(ids)
+ return table
+
+def load_table(path=table_path):
+ """ Map the best hand table file, making it first if it's missing
+ or out of date. Falls back to a table in memory if the file can't
+ be written. """
+ header = (table_magic, deck_checksum(), table_entries, entry_size)
+ try:
+   with open(path, "rb") as f:
+     table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+   if len(table) == table_header.size + table_entries * entry_size and \
+      table_header.unpack_from(table) == header:
+     return table
+   table.close()
+ except (OSError, ValueError):
+   pass
+ table = build_table()
+ # Workers starting together may all build it, so each writes its own
+ # file and moves it into place
+ temp = None
+ try:
+   (fd, temp) = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                 dir=os.path.dirname(os.path.abspath(path)))
+   with os.fdopen(fd, "wb") as f:
+     f.write(table)
+   # mkstemp makes it private
+   os.chmod(temp, 0o644)
+   os.replace(temp, path)
+   with open(path, "rb") as f:
+     return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+ except OSError:
+   if temp is not None and os.path.exists(temp):
+     os.remove(temp)
+   return table
+
+best_table = load_table()
+
+def mask_score(mask):
+ """ The best hand score of a mask of card ids """
+ return best_table[table_header.size + entry_size * table_key(mask)]
+
+def lookup(mask):
+ """ The score and card ids of the best hand with this mask """
+ offset = table_header.size + entry_size * table_key(mask)
+ ids = [ i for i in best_table[offset + 1:offset + entry_size] if i != no_card ]
+ return (best_table[offset], ids)
+
+def card_id(card):
+ try:
+   return card_ids[card]
+ except KeyError:
+   raise KeyError("Invalid card name '%s'" % card)
+
+# What parsing a description looks for: names written with a space
+# for a hyphen, which are joined up first, even inside other words as
+# in "xnon christian", and then whole words that are card names, all
+# in lower case
+joined_names = [ (card.lower().replace('-', ' '), card.lower())
+                 for card in deck_cards if '-' in card ]
+word_ids = dict((card.lower(), card_ids[card]) for card in card_names)
+# Where each card comes in deck order, which parsed hands are in
+deck_rank = dict((card_ids[card], n) for (n, card) in enumerate(deck_cards))
+
+def parse_words(desc):
+ """ Ids of the cards named in a description, as often as they're
+ named """
+ desc = desc.lower()
+ for (spaced, hyphenated) in joined_names:
+   if spaced in desc:
+     desc = desc.replace(spaced, hyphenated)
+ return [ word_ids[w] for w in desc.split() if w in word_ids ]
+
+def parse_ids(desc):
+ """ Ids of the cards named in a description, each once, in deck
+ order """
+ return sorted(set(parse_words(desc)), key=deck_rank.__getitem__)
+
+def parse_score(desc):
+ """ The best score of the cards named in a description """
+ mask = 0
+ for i in parse_words(desc):
+   mask |= 1 << i
+ return mask_score(mask)
+
+def parse_chunk(descs, scores=False):
+ """ parse_ids(), or parse_score(), for a list of descriptions """
+ if scores:
+   return [ parse_score(d) for d in descs ]
+ return [ parse_ids(d) for d in descs ]
+
+def parse_many(descs, scores=False, pool=None, chunk_size=10000, in_flight=None):
+ """ Generate the Hand of each of an iterable of descriptions, such as
+ the lines of a file, or its best score if scores is true. Given a
+ concurrent.futures pool, chunks of descriptions are parsed there,
+ in_flight at a time, by default two per core, so the iterable is
+ read as it's needed. """
+ descs = iter(descs)
+ chunks = iter(lambda: list(itertools.islice(descs, chunk_size)), [])
+ if pool is None:
+   parsed = (parse_chunk(chunk, scores) for chunk in chunks)
+ else:
+   if in_flight is None:
+     in_flight = 2 * (os.cpu_count() or 1)
+   parsed = pool_map(pool, in_flight, parse_chunk, chunks, scores)
+ for results in parsed:
+   for r in results:
+     yield r if scores else Hand.from_ids(r)
+
+def pool_map(pool, in_flight, func, chunks, *args):
+ """ Results of func on each chunk, in order, with no more than
+ in_flight chunks in the pool at a time """
+ pending = collections.deque()
+ for chunk in chunks:
+   pending.append(pool.submit(func, chunk, *args))
+   if len(pending) >= in_flight:
+     yield pending.popleft().result()
+ while pending:
+   yield pending.popleft().result()
 
 def cardscore(card):
  """ How much does this card score? """
- (s, unused_cls) = deck[card]
- return s
+ return card_scores[card_ids[card]]
 
 def cardclass(card):
  """ What class does this card represent? """
- (unused_s, cls) = deck[card]
- return cls
+ return category_list[card_classes[card_ids[card]]]
 
 
 class Hand(object):
- """ A hand is a list of cards with some associated scoring functions """
+ """ A hand is a list of cards with some associated scoring functions.
+ Cards are kept as ids: a mask of the ids the hand holds and the order
+ they were added in. """
+ __slots__ = ('mask', 'order')
+
  def __init__(self, start_cards=None):
-  if start_cards is None:
-   self.cards = []
-  else:
-   self.cards = start_cards[:]
+  self.mask = 0
+  self.order = array.array('B')
+  if start_cards is not None:
+   for card in start_cards:
+    self.add_id(card_id(card))
+
+ @classmethod
+ def from_ids(cls, ids):
+  hand = cls()
+  for i in ids:
+   hand.add_id(i)
+  return hand
 
  @classmethod
  def parse(cls, desc):
-  desc = desc.lower()
-  for card in deck.keys():
-    if card.find('-') >= 0:
-      # handle the hyphens
-      c = card.lower() 
-      nc = c.replace('-', ' ')
-      desc = desc.replace(nc, c)
-  words = desc.split()
-  nonempty_words = set([w for w in words if len(w) >= 1])
-  cards = [c for c in deck.keys() if c.lower() in nonempty_words]
-  return Hand(cards)
+  """ The hand of cards named in a description, each once, such as
+  "native american woman" """
+  return cls.from_ids(parse_ids(desc))
+
+ @property
+ def cards(self):
+  """ The names of the cards, as a tuple since changing it wouldn't
+  change the hand: use add() to add to it, or set cards """
+  return tuple([ card_names[i] for i in self.order ])
+
+ @cards.setter
+ def cards(self, cards):
+  self.mask = 0
+  self.order = array.array('B')
+  for card in cards:
+   self.add(card)
 
  def add(self, card):
-  self.cards.append(card)
+  self.add_id(card_id(card))
+
+ def add_id(self, i):
+  self.mask |= 1 << i
+  self.order.append(i)
 
  def bestscore(self):
-  (score, bestcards) = self.besthand()
-  return score
+  """ The score of besthand(), from the best hand table """
+  return mask_score(self.mask)
 
  def bestcards(self):
   (score, bestcards) = self.besthand()
   return bestcards
 
+ def best_ids(self):
+  """ Ids of the cards of besthand() """
+  best = scratch_best
+  best.clear()
+  for i in self.order:
+    best.add_id(i)
+  return best.best_ids()
+
  def besthand(self):
   """ What's the highest possible score for this hand?
   Limitations: one card per class, no more than 5
   cards in total
   Return (score, best_hand)
   """
-  score_by_class = { }
-  card_by_class = { }
-  for card in self.cards:
-    try:
-      s = cardscore(card)
-      card_class = cardclass(card) 
-    except KeyError as err:
-      raise KeyError("Invalid card name '%s'" % card)
-    if card_class not in score_by_class:
-      score_by_class[card_class] = s
-    if s >= score_by_class[card_class]:
-      score_by_class[card_class] = s
-      card_by_class[card_class] = card
-  # We now have the best scoring card in each
-  # class. But we can only use the best 5.
-  cards = card_by_class.values()
-  cards = sorted(cards, key=cardscore)
-  if len(cards) > 5:
-    cards = cards[0:5]
+  # The best scoring card in each class, the last one in the hand if
+  # there's a tie. But we can only use the best 5.
+  ids = self.best_ids()
   tot = 0
-  for card in cards:
-    tot += cardscore(card)
-  best_hand = Hand(cards)
-  return (tot, best_hand)
+  for i in ids:
+    tot += card_scores[i]
+  return (tot, Hand.from_ids(ids))
 
  def merge(self, hand):
   """ Merge this hand and another to return a new one """
   ans = self.copy()
-  for c in hand.cards:
-   ans.add(c)
+  for i in hand.order:
+   ans.add_id(i)
   return ans
 
  def copy(self):
-  return Hand(self.cards)
+  ans = Hand()
+  ans.mask = self.mask
+  ans.order = array.array('B', self.order)
+  return ans
  
  def __str__(self):
-  return ', '.join(['%s (%d)' % (c, cardscore(c)) for c in self.cards])
+  return ', '.join(['%s (%d)' % (card_names[i], card_scores[i]) for i in self.order])
 
  def card_in_class(self,class_name):
   """Returns a card in the given class, if the hand has one"""
-  for card in self.cards:
-   (s,c) = deck[card] 
-   if c == class_name:
-    return card
+  c = category_list.index(class_name) if class_name in categories else -1
+  for i in self.order:
+   if card_classes[i] == c:
+    return card_names[i]
   # No match
   return None
 
@@ -141,42 +342,130 @@ class Hand(object):
    card_order = filter(lambda x: x is not None, card_order)
    return ' '.join(card_order)
 
+class ClassBest(object):
+ """ What besthand() needs to know about a run of cards, kept up to
+ date as they're added: the best card of each class, the last one if
+ there's a tie, the classes in the order they turned up, and the mask
+ of card ids """
+ __slots__ = ('best', 'classes', 'mask')
+
+ def __init__(self):
+  self.best = [ -1 ] * len(category_list)
+  self.classes = []
+  self.mask = 0
+
+ def clear(self):
+  """ Forget the cards, keeping the lists to use again """
+  for c in self.classes:
+   self.best[c] = -1
+  del self.classes[:]
+  self.mask = 0
+
+ def add_id(self, i):
+  c = card_classes[i]
+  b = self.best[c]
+  if b < 0:
+   self.best[c] = i
+   self.classes.append(c)
+  elif card_scores[i] >= card_scores[b]:
+   self.best[c] = i
+  self.mask |= 1 << i
+
+ def best_ids(self, after=None):
+  """ Ids of the cards of besthand() for these cards followed by
+  those of after, another ClassBest """
+  if after is None:
+   best = self.best
+   classes = self.classes
+  else:
+   best = list(self.best)
+   classes = list(self.classes)
+   for c in after.classes:
+    b = best[c]
+    i = after.best[c]
+    if b < 0:
+     best[c] = i
+     classes.append(c)
+    elif card_scores[i] >= card_scores[b]:
+     best[c] = i
+  ids = [ best[c] for c in classes ]
+  ids.sort(key=card_scores.__getitem__)
+  return ids[0:5]
+
+ def bestscore(self, after=None):
+  """ The score of best_ids(), from the best hand table """
+  mask = self.mask
+  if after is not None:
+   mask |= after.mask
+  return mask_score(mask)
+
+# Cleared and used again by Hand.best_ids(), rather than making a new one
+# for every hand scored
+scratch_best = ClassBest()
+
 class Game(object):
  def __init__(self, player_count, deck_multiple=2):
    self.player_count = player_count
    self.deck_multiple = deck_multiple
    self.player_hands = { }
+   # Kept up to date as cards are dealt, so best hands don't have to
+   # be worked out from all the cards each time
+   self.player_best = { }
    for i in range(1,1+player_count):
      self.player_hands[i] = Hand()
+     self.player_best[i] = ClassBest()
    self.shuffle_deck()
    self.community = Hand()
+   self.community_best = ClassBest()
 
  def shuffle_deck(self):
-   self.deck = []
-   for i in range(self.deck_multiple):
-    self.deck.extend(deck.keys())
+   self.deck = deck_cards * self.deck_multiple
    random.shuffle(self.deck)
 
+ def check_deck(self, cards):
+   if cards > len(self.deck):
+     raise ValueError("Can't deal %d cards with %d left in the deck" % (cards, len(self.deck)))
+
  def deal(self, cards_per_player):
+   self.check_deck(cards_per_player * self.player_count)
    for p in range(1,1+self.player_count):
      for c in range(cards_per_player): 
-       card = self.deck.pop()  # might run out
-       self.player_hands[p].add(card)
+       card = self.deck.pop()
+       i = card_id(card)
+       self.player_hands[p].add_id(i)
+       self.player_best[p].add_id(i)
 
  def deal_community(self, community_cards):
+   self.check_deck(community_cards)
    self.community = Hand()
+   self.community_best = ClassBest()
    for c in range(community_cards):
-    card = self.deck.pop()
-    self.community.add(card)
+    i = card_id(self.deck.pop())
+    self.community.add_id(i)
+    self.community_best.add_id(i)
 
  def get_community(self):
   return self.community
 
  def best_hand(self, player_num):
-   h = self.player_hands[player_num]
-   # Expand the hand with any community cards
-   h2 = h.merge(self.community)
-   return h2.besthand()
+   """ (score, best hand) of a player's cards and the community
+   cards, as from Hand.besthand() """
+   ids = self.player_best[player_num].best_ids(self.community_best)
+   tot = 0
+   for i in ids:
+     tot += card_scores[i]
+   return (tot, Hand.from_ids(ids))
+
+ def best_score(self, player_num):
+   return self.player_best[player_num].bestscore(self.community_best)
+
+ def ranking(self):
+   """ (score, player) for every player, best first, players with the
+   same score in seat order """
+   scores = [ (self.player_best[p].bestscore(self.community_best), p)
+              for p in range(1,1+self.player_count) ]
+   scores.sort(key=lambda s: -s[0])
+   return scores
 
 if __name__ == '__main__':
  descriptions = [
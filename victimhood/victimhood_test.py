@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import io
+import itertools
+import os
+import random
+import tempfile
+import unittest
+import numpy as np
+
+import tournament
+import vectorized
+import victimhood
+
+def list_besthand(cards):
+ """ Hand.besthand() as it was with lists of card names, to check the
+ current one against: (score, best cards) """
+ score_by_class = { }
+ card_by_class = { }
+ for card in cards:
+   s = victimhood.cardscore(card)
+   card_class = victimhood.deck[card][1]
+   if card_class not in score_by_class:
+     score_by_class[card_class] = s
+   if s >= score_by_class[card_class]:
+     score_by_class[card_class] = s
+     card_by_class[card_class] = card
+ best = tuple(sorted(card_by_class.values(), key=victimhood.cardscore)[0:5])
+ return (sum([ victimhood.cardscore(card) for card in best ]), best)
+
+def scan_parse(desc):
+ """ Hand.parse() as it was, scanning the deck for each description:
+ the names of the cards found """
+ desc = desc.lower()
+ for card in victimhood.deck.keys():
+   if card.find('-') >= 0:
+     c = card.lower()
+     desc = desc.replace(c.replace('-', ' '), c)
+ words = set(desc.split())
+ return tuple([ c for c in victimhood.deck.keys() if c.lower() in words ])
+
+def random_description(rng):
+ words = list(victimhood.deck.keys()) + [ "native american", "east indian", "non christian",
+   "NATIVE  american", "man,", "x", "woman", "beast indian", "native-americans",
+   "East\tIndian", "non christian woman", " ", "\n" ]
+ desc = "".join([ rng.choice(words) + rng.choice([ " ", "  ", "-", ",", "", " " ])
+                  for i in range(0, rng.randint(0, 8)) ])
+ return "".join([ ch.upper() if rng.random() < 0.2 else ch for ch in desc ])
+
+def random_cards(rng, most=12):
+ names = sorted(victimhood.deck.keys())
+ return [ rng.choice(names) for i in range(0, rng.randint(0, most)) ]
+
+class TestVictimhood(unittest.TestCase):
+ def test_hand(self):
+   rng = random.Random(1)
+   for t in range(0, 5000):
+     cards = random_cards(rng)
+     h = victimhood.Hand(cards)
+     self.assertEqual(h.cards, tuple(cards))
+     (score, best) = h.besthand()
+     self.assertEqual((score, best.cards), list_besthand(cards))
+     self.assertEqual(h.bestscore(), score)
+     self.assertEqual(h.bestcards().cards, best.cards)
+     self.assertEqual(str(h), ', '.join([ '%s (%d)' % (c, victimhood.cardscore(c))
+                                         for c in cards ]))
+     more = random_cards(rng, 4)
+     merged = h.merge(victimhood.Hand(more))
+     self.assertEqual(merged.cards, tuple(cards + more))
+     self.assertEqual(h.cards, tuple(cards))
+     self.assertEqual(merged.besthand()[0], list_besthand(cards + more)[0])
+   h = victimhood.Hand([ 'Woman', 'Man' ])
+   self.assertEqual(h.card_in_class('gender'), 'Woman')
+   self.assertEqual(h.card_in_class('skin'), None)
+   self.assertEqual(h.card_in_class('nonsense'), None)
+   # Ties go to the card that came last
+   self.assertEqual(victimhood.Hand([ 'Female', 'Woman' ]).bestcards().cards, ( 'Woman', ))
+   self.assertEqual(victimhood.Hand([ 'Woman', 'Female' ]).bestcards().cards, ( 'Female', ))
+   # cards can't be changed in place, but can be set
+   self.assertRaises(AttributeError, getattr, h.cards, 'append')
+   h.cards = [ 'Black', 'Gay' ]
+   self.assertEqual((h.cards, h.bestscore()), (( 'Black', 'Gay' ), 23))
+   self.assertRaises(KeyError, victimhood.Hand, [ 'Martian' ])
+
+ def test_table(self):
+   rng = random.Random(2)
+   for t in range(0, 5000):
+     h = victimhood.Hand(random_cards(rng))
+     (score, best) = h.besthand()
+     self.assertEqual(victimhood.mask_score(h.mask), score)
+     (table_score, ids) = victimhood.lookup(h.mask)
+     self.assertEqual(table_score, score)
+     self.assertEqual(sorted([ victimhood.card_scores[i] for i in ids ]),
+                      sorted([ victimhood.cardscore(c) for c in best.cards ]))
+   self.assertEqual(victimhood.lookup(0), (0, []))
+   built = victimhood.build_table()
+   self.assertEqual(bytes(built), victimhood.best_table[:])
+   with tempfile.TemporaryDirectory() as tmp:
+     path = os.path.join(tmp, "besthand.table")
+     # Missing, short, stale and good files
+     for junk in [ None, b"VHBT", built[:-1], b"VHBX" + built[4:], built ]:
+       if junk is not None:
+         with open(path, "wb") as f:
+           f.write(junk)
+       table = victimhood.load_table(path)
+       self.assertEqual(table[:], bytes(built))
+       table.close()
+       with open(path, "rb") as f:
+         self.assertEqual(f.read(), bytes(built))
+     self.assertEqual(os.listdir(tmp), [ "besthand.table" ])
+     # Kept in memory where it can't be written
+     table = victimhood.load_table(os.path.join(tmp, "missing", "besthand.table"))
+     self.assertEqual(bytes(table), bytes(built))
+     self.assertEqual(os.listdir(tmp), [ "besthand.table" ])
+
+ def test_equity(self):
+   rng = random.Random(3)
+   masks = [ sum([ 1 << victimhood.card_id(c) for c in random_cards(rng) ])
+             for t in range(0, 2000) ]
+   self.assertEqual(list(vectorized.score_masks(masks)),
+                    [ victimhood.mask_score(m) for m in masks ])
+   random.seed(5)
+   g = victimhood.Game(3, deck_multiple=1)
+   g.deal(3)
+   players = [ list(g.player_hands[p].order) for p in range(1, 4) ]
+   deck = [ victimhood.card_id(c) for c in g.deck ]
+   # One community card, then one more each, every way
+   wins = np.zeros(3)
+   ties = np.zeros(3)
+   deals = list(itertools.permutations(range(0, len(deck)), 4))
+   for deal in deals:
+     scores = [ victimhood.Hand.from_ids(players[p] + [ deck[deal[0]], deck[deal[p + 1]] ])
+                .bestscore() for p in range(0, 3) ]
+     for p in range(0, 3):
+       if scores[p] == max(scores):
+         if scores.count(max(scores)) == 1:
+           wins[p] += 1
+         else:
+           ties[p] += 1
+   exact = vectorized.game_equity(g, community_cards=1, cards_per_player=4)
+   self.assertTrue(exact.exact)
+   self.assertEqual(exact.completions, len(deals))
+   self.assertTrue(np.allclose(exact.win, wins / len(deals)))
+   self.assertTrue(np.allclose(exact.tie, ties / len(deals)))
+   sampled = vectorized.game_equity(g, community_cards=1, cards_per_player=4, exact_limit=0,
+                                    trials=200000, rng=np.random.default_rng(1))
+   self.assertFalse(sampled.exact)
+   self.assertEqual(sampled.completions, 200000)
+   self.assertTrue(np.allclose(sampled.win, exact.win, atol=0.01))
+   self.assertTrue(np.allclose(sampled.tie, exact.tie, atol=0.01))
+   # Nothing to come
+   now = vectorized.game_equity(g)
+   self.assertEqual(now.completions, 1)
+   self.assertRaises(ValueError, vectorized.game_equity, g, community_cards=len(g.deck) + 1)
+   self.assertRaises(ValueError, vectorized.equity, players, [], deck[:5], 0, 2)
+
+ def test_game(self):
+   for seed in range(0, 1000):
+     random.seed(seed)
+     g = victimhood.Game(5, deck_multiple=2)
+     g.deal(random.randint(0, 5))
+     g.deal_community(random.randint(0, 4))
+     g.deal(random.randint(0, 2))
+     ranking = g.ranking()
+     self.assertEqual(sorted([ p for (score, p) in ranking ]), [ 1, 2, 3, 4, 5 ])
+     self.assertEqual([ score for (score, p) in ranking ],
+                      sorted([ score for (score, p) in ranking ], reverse=True))
+     for (score, p) in ranking:
+       (best_score, best) = list_besthand(g.player_hands[p].cards + g.community.cards)
+       self.assertEqual(score, best_score)
+       self.assertEqual(g.best_score(p), best_score)
+       (game_score, hand) = g.best_hand(p)
+       self.assertEqual((game_score, hand.cards), (best_score, best))
+
+ def test_deal(self):
+   random.seed(1)
+   g = victimhood.Game(4, deck_multiple=1)
+   self.assertEqual(sorted(g.deck), sorted(victimhood.deck.keys()))
+   g.deal(5)
+   self.assertEqual(len(g.deck), 2)
+   self.assertRaises(ValueError, g.deal, 1)
+   self.assertRaises(ValueError, g.deal_community, 3)
+   # Nothing was taken
+   self.assertEqual(len(g.deck), 2)
+   self.assertEqual([ len(g.player_hands[p].cards) for p in range(1, 5) ], [ 5 ] * 4)
+   g.deal_community(2)
+   self.assertEqual((len(g.deck), len(g.community.cards)), (0, 2))
+
+ def test_tournament(self):
+   def totals(workers):
+     t = tournament.run_tournament(30000, players=3, cards=4, community=2, seed=7,
+                                   workers=workers, shard_size=7000)
+     return (t.games, list(t.seat_wins), list(t.seat_ties), list(t.card_hands),
+             list(t.card_wins), list(t.card_ties))
+
+   # The same results however many workers there are
+   one = totals(1)
+   self.assertEqual(one, totals(3))
+   (games, seat_wins, seat_ties, card_hands, card_wins, card_ties) = one
+   self.assertEqual(games, 30000)
+   self.assertTrue(sum(seat_wins) + sum(seat_ties) >= games)
+   self.assertTrue(sum(seat_wins) <= games)
+   # Every hand holds at least one of its four cards and at most four
+   self.assertTrue(3 * games <= sum(card_hands) <= 12 * games)
+   # Against games played with Game
+   random.seed(0)
+   wins = [ 0, 0, 0 ]
+   for i in range(0, 5000):
+     g = victimhood.Game(3, deck_multiple=2)
+     g.deal(4)
+     g.deal_community(2)
+     ranking = g.ranking()
+     if ranking[0][0] > ranking[1][0]:
+       wins[ranking[0][1] - 1] += 1
+   self.assertAlmostEqual(sum(wins) / 5000, sum(seat_wins) / games, delta=0.03)
+   self.assertRaises(ValueError, tournament.run_tournament, 10, players=10, cards=5,
+                     deck_multiple=1)
+   out = io.StringIO()
+   tournament.report(tournament.run_tournament(0, workers=1), out)
+   self.assertTrue(out.getvalue().startswith("0 games"))
+
+ def test_parse(self):
+   rng = random.Random(4)
+   descs = [ random_description(rng) for i in range(0, 5000) ]
+   descs += [ "chinese gay transgender", "native american east asian woman",
+              "xnon christian man", "Non-Christian CHRISTIAN", "" ]
+   for d in descs:
+     self.assertEqual(victimhood.Hand.parse(d).cards, scan_parse(d))
+   self.assertEqual(victimhood.Hand.parse("native american woman").cards,
+                    ( 'Native-American', 'Woman' ))
+   scores = [ victimhood.Hand(scan_parse(d)).bestscore() for d in descs ]
+   hands = list(victimhood.parse_many(iter(descs), chunk_size=300))
+   self.assertEqual([ h.cards for h in hands ], [ scan_parse(d) for d in descs ])
+   self.assertEqual(list(victimhood.parse_many(descs, scores=True, chunk_size=300)), scores)
+   with concurrent.futures.ProcessPoolExecutor(2) as pool:
+     self.assertEqual(list(victimhood.parse_many(descs, scores=True, pool=pool,
+                                                 chunk_size=300, in_flight=3)), scores)
+     self.assertEqual([ h.cards for h in victimhood.parse_many(descs, pool=pool,
+                                                               chunk_size=700) ],
+                      [ h.cards for h in hands ])
+   self.assertEqual(list(victimhood.parse_many([])), [])
+
+if __name__ == "__main__":
+ unittest.main()